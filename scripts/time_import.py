@@ -0,0 +1,24 @@
+#! /usr/bin/env python
+"""time how long ``import twiggy`` takes, over an empty interpreter"""
+import subprocess
+import sys
+import os
+import time
+
+loops = 20
+
+def best(code):
+    env = dict(os.environ)
+    env.pop('TWIGGY_UNDER_TEST', None)
+    times = []
+    for i in range(loops):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code], env=env)
+        times.append(time.time() - start)
+    return min(times)
+
+base = best("pass")
+t = best("import twiggy")
+
+print "{0:.1f} ms for import twiggy ({1:.1f} ms over {2:.1f} ms startup), best of {3:n}".format(
+    t * 1000, (t - base) * 1000, base * 1000, loops)
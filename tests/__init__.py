@@ -6,11 +6,18 @@ import twiggy
 # an arbitrary but consistent time
 when = datetime(2010, 10, 28, 2, 15, 57, 301)
 
-def make_mesg():
-    return Message(twiggy.levels.DEBUG,
-                   "Hello {0} {who}",
-                   {'shirt':42, 'name': 'jose'},
-                   Message._default_options,
-                   args=["Mister"],
-                   kwargs={'who':"Funnypants"},
-                   )
+def make_mesg(level=twiggy.levels.DEBUG, text=None, trace=None, fields=None, **kwargs):
+    """make a message. Fields are ``fields`` (default: ``shirt`` and ``name``) updated with ``kwargs``.
+
+    If ``text`` is given, it's used as the message text as-is.
+    """
+    if fields is None:
+        fields = {'shirt': 42, 'name': 'jose'}
+    fields = dict(fields, **kwargs)
+    options = Message._default_options
+    if trace is not None:
+        options = dict(options, trace=trace)
+    if text is None:
+        return Message(level, "Hello {0} {who}", fields, options,
+                       args=["Mister"], kwargs={'who':"Funnypants"})
+    return Message(level, "{0}", fields, options, args=[text], kwargs={})
@@ -0,0 +1,49 @@
+import unittest
+import threading
+
+from twiggy import context
+
+class ContextTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        context.clear()
+
+    def test_empty(self):
+        assert context.get_fields() is None
+
+    def test_bind(self):
+        with context.bind(a=1):
+            assert context.get_fields() == {'a':1}
+            with context.bind_dict({'b':2, 'a':3}):
+                assert context.get_fields() == {'a':3, 'b':2}
+            assert context.get_fields() == {'a':1}
+        assert context.get_fields() is None
+
+    def test_bind_exception(self):
+        with self.assertRaises(RuntimeError):
+            with context.bind(a=1):
+                raise RuntimeError("BOOM")
+        assert context.get_fields() is None
+
+    def test_no_mutation(self):
+        with context.bind(a=1):
+            d = context.get_fields()
+            with context.bind(b=2):
+                pass
+            assert d == {'a':1}
+
+    def test_clear(self):
+        with context.bind(a=1):
+            context.clear()
+            assert context.get_fields() is None
+
+    def test_thread_local(self):
+        seen = []
+        def other():
+            seen.append(context.get_fields())
+
+        with context.bind(a=1):
+            t = threading.Thread(target=other)
+            t.start()
+            t.join()
+        assert seen == [None]
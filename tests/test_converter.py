@@ -153,3 +153,20 @@ class ConversionTableTestCase(unittest.TestCase):
         ct = ConversionTable([c])
         with self.assertRaises(ValueError):
             ct.convert({'shirt':42}) == {'shirt':42}
+
+    def test_missing_dropped(self):
+        c = Converter("pants", conv_val, drop, True)
+        ct = ConversionTable([c])
+        assert ct.convert({'shirt':42}) == {'shirt':42}
+
+    def test_uses(self):
+        ct = ConversionTable([
+            ("joe", "I wear {}".format, conv_item),
+            ("frank", "You wear {}".format, drop)])
+        assert ct.uses('joe')
+        assert not ct.uses('frank')
+        assert ct.uses('bob')
+
+        ct.generic_item = drop
+        assert not ct.uses('bob')
+        assert ct.uses('joe')
@@ -1,8 +1,10 @@
 import unittest
 
 import re
+import time
+import threading
 
-from twiggy import filters, message, levels
+from twiggy import filters, message, levels, outputs, formats
 
 from . import make_mesg
 
@@ -101,6 +103,32 @@ class namesTestCase(unittest.TestCase):
         assert filters.glob_names("jo*", "frank")(m)
         assert not filters.glob_names("*bob", "frank")(m)
 
+    def test_pre_filters(self):
+        assert filters.names("jose").pre_filter(levels.DEBUG, {'name': 'jose'})
+        assert not filters.names("jose").pre_filter(levels.DEBUG, {'name': 'bob'})
+        assert not filters.names("jose").pre_filter(levels.DEBUG, {})
+        # can't tell until the message is created
+        assert filters.names("jose").pre_filter(levels.DEBUG, {'name': lambda: 'bob'})
+
+        assert filters.glob_names("jo*").pre_filter(levels.DEBUG, {'name': 'jose'})
+        assert not filters.glob_names("jo*").pre_filter(levels.DEBUG, {'name': 'bob'})
+
+        f = filters.msg_filter([filters.names("jose"), "^Hello"])
+        assert f.pre_filter(levels.DEBUG, {'name': 'jose'})
+        assert not f.pre_filter(levels.DEBUG, {'name': 'bob'})
+        assert not filters.msg_filter(False).pre_filter(levels.DEBUG, {})
+        assert not hasattr(filters.msg_filter("^Hello"), 'pre_filter')
+
+    def test_uses_field(self):
+        assert filters.names("jose").uses_field('name')
+        assert not filters.names("jose").uses_field('time')
+        assert not filters.glob_names("jo*").uses_field('time')
+        assert not filters.msg_filter("^Hello").uses_field('time')
+        assert not filters.msg_filter(None).uses_field('time')
+        assert not filters.msg_filter(["^Hello", filters.names("jose")]).uses_field('time')
+        assert filters.msg_filter(["^Hello", lambda msg: True]).uses_field('time')
+        assert not hasattr(filters.msg_filter(lambda msg: True), 'uses_field')
+
 class EmitterTestCase(unittest.TestCase):
 
     def test_bad_min_level(self):
@@ -120,3 +148,123 @@ class EmitterTestCase(unittest.TestCase):
         f = e.filter
         assert callable(f)
         assert not f(m)
+
+    def test_uses_field(self):
+        e = filters.Emitter(levels.INFO, None, outputs.NullOutput(close_atexit=False))
+        assert not e.uses_field('time')
+        e.filter = lambda msg: True
+        assert e.uses_field('time')
+
+        e = filters.Emitter(levels.INFO, None, outputs.StreamOutput(formats.shell_format))
+        assert not e.uses_field('time')
+        assert e.uses_field('pants')
+
+    def test_pre_filter(self):
+        e = filters.Emitter(levels.INFO, None, 'output-unused')
+        assert e.pre_filter is None
+
+        names = filters.names("jose")
+        e.filter = names
+        assert e.pre_filter is names.pre_filter
+        e.filter = None
+        assert e.pre_filter is None
+
+        pre = lambda level, fields: True
+        e = filters.Emitter(levels.INFO, names, 'output-unused', pre_filter=pre)
+        assert e.pre_filter is pre
+        e.filter = filters.names("bob")
+        assert e.pre_filter is pre
+
+class FingersCrossedEmitterTestCase(unittest.TestCase):
+
+    def test_wraps_output(self):
+        out = outputs.ListOutput(close_atexit=False)
+        e = filters.FingersCrossedEmitter(levels.DEBUG, None, out, key='job', max_groups=5)
+        assert isinstance(e._output, outputs.FingersCrossedOutput)
+        assert e._output.target is out
+        assert e._output.key == 'job'
+        assert e._output.max_groups == 5
+
+        msg = make_mesg(job='x')
+        e._output.output(msg)
+        assert e._output._groups
+        e.finish('x')
+        assert not e._output._groups
+
+class EmittersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.out = outputs.ListOutput(close_atexit=False)
+        self.emitters = filters.Emitters()
+
+    def test_config(self):
+        a = filters.Emitter(levels.DEBUG, None, self.out)
+        b = filters.Emitter(levels.INFO, None, self.out)
+        assert self.emitters.config == ()
+
+        self.emitters['b'] = b
+        self.emitters['a'] = a
+        assert self.emitters.config == (('a', a), ('b', b))
+
+        config = self.emitters.config
+        del self.emitters['a']
+        assert self.emitters.config == (('b', b),)
+        # old snapshots are unchanged
+        assert config == (('a', a), ('b', b))
+
+        self.emitters.update(a=a)
+        assert self.emitters.config == (('a', a), ('b', b))
+        assert self.emitters.pop('b') is b
+        assert self.emitters.config == (('a', a),)
+        self.emitters.clear()
+        assert self.emitters.config == ()
+
+    def test_replace(self):
+        class CloseOutput(outputs.ListOutput):
+            closed = False
+            def _close(self):
+                self.closed = True
+
+        old = CloseOutput(close_atexit=False)
+        shared = CloseOutput(close_atexit=False)
+        self.emitters['old'] = filters.Emitter(levels.DEBUG, None, old)
+        self.emitters['shared'] = filters.Emitter(levels.DEBUG, None, shared)
+
+        new = {'new': filters.Emitter(levels.INFO, None, self.out),
+               'shared': filters.Emitter(levels.DEBUG, None, shared)}
+        self.emitters.replace(new)
+
+        assert sorted(self.emitters) == ['new', 'shared']
+        assert [name for name, e in self.emitters.config] == ['new', 'shared']
+        assert old.closed
+        assert not shared.closed
+
+    def test_replace_drains(self):
+        token = self.emitters._enter()
+        start = time.time()
+        self.emitters.replace({}, timeout=0.05)
+        # waited for the in-flight message, then gave up
+        assert time.time() - start >= 0.05
+        self.emitters._exit(token)
+
+        token = self.emitters._enter()
+        self.emitters._exit(token)
+        start = time.time()
+        self.emitters.replace({}, timeout=5)
+        assert time.time() - start < 1
+
+    def test_replace_unlocked_while_draining(self):
+        token = self.emitters._enter()
+        t = threading.Thread(target=self.emitters.replace, args=({},), kwargs={'timeout': 5})
+        t.start()
+        time.sleep(0.05)
+        try:
+            # the lock isn't held while waiting for the in-flight message
+            assert self.emitters._lock.acquire(False)
+            self.emitters._lock.release()
+            self.emitters['a'] = filters.Emitter(levels.DEBUG, None, self.out)
+            assert t.is_alive()
+        finally:
+            self.emitters._exit(token)
+            t.join()
+        assert 'a' in self.emitters
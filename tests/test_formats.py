@@ -3,7 +3,7 @@ import copy
 
 from twiggy import formats, levels, message
 
-from . import when
+from . import when, make_mesg
 
 class ConversionsTestCase(unittest.TestCase):
 
@@ -126,3 +126,46 @@ class FormatTestCase(unittest.TestCase):
         s = fmt(msg)
         l = s.split('\n')
         assert len(l) == 2
+
+class TruncateTestCase(unittest.TestCase):
+
+    fields = {
+        'time': when,
+        'level': levels.INFO,
+        'name': 'mylog',
+        }
+
+    def test_truncate_value(self):
+        assert formats.truncate_value('x' * 10, 10) == 'x' * 10
+        assert formats.truncate_value('x' * 30, 10) == 'x' * 10 + '...[20 bytes truncated]'
+        assert formats.truncate_value(when, 3) is when
+        assert formats.truncate_value(range(1000), 20) == '[0, 1, 2, 3, 4, 5, 6...[993 items truncated]'
+        l = range(3)
+        assert formats.truncate_value(l, 20) is l
+        assert formats.truncate_value({'a': 1, 'b': 2}, 6).endswith('...[2 items truncated]')
+        assert formats.truncate_value(object(), 5).startswith('<obje...[')
+
+    def test_max_value_length(self):
+        fmt = formats.LineFormat(conversion=formats.line_conversion, max_value_length=5)
+        s = fmt(make_mesg(levels.INFO, "hi", trace='error', fields=self.fields, ids=range(1000), body='x' * 100))
+        assert s == '2010-10-28T02:15:57.000301:INFO:mylog:body=xxxxx...[95 bytes truncated]:'\
+                    'ids=[0, 1...[998 items truncated]|hi\n', s
+
+    def test_max_line_length(self):
+        fmt = formats.LineFormat(conversion=formats.shell_format.conversion, max_line_length=20)
+        assert fmt(make_mesg(levels.INFO, "hi", trace='error', fields=self.fields)) == 'INFO:mylog|hi\n'
+
+        s = fmt(make_mesg(levels.INFO, "hello\nworld", trace='error', fields=self.fields))
+        assert s == 'INFO:mylog|hello\\nwo...[3 bytes truncated]\n', s
+
+        short = copy.copy(fmt)
+        short.max_line_length = 5
+        assert short(make_mesg(levels.INFO, "hi", trace='error', fields=self.fields)) == 'INFO:...[8 bytes truncated]\n'
+
+        try:
+            1/0
+        except ZeroDivisionError:
+            msg = make_mesg(levels.INFO, "hi", trace='error', fields=self.fields)
+        full = formats.LineFormat(conversion=formats.shell_format.conversion)(msg)
+        s = fmt(msg)
+        assert s == full[:20] + '...[{0} bytes truncated]\n'.format(len(full) - 21), s
@@ -2,6 +2,7 @@ import unittest
 import sys
 import os
 import tempfile
+import subprocess
 
 import twiggy
 
@@ -84,7 +85,26 @@ class GlobalsTestCase(unittest.TestCase):
         e = twiggy.emitters['*']
         assert isinstance(e, twiggy.filters.Emitter)
         assert isinstance(e._output, twiggy.outputs.FileOutput)
+
+        # the file is opened lazily
+        assert not os.path.exists(fname)
+        twiggy.log.info('hi')
+        e._output.close()
         assert os.path.exists(fname)
+        assert open(fname).read().endswith('INFO|hi\n')
+
+class ImportTestCase(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        # keep `import twiggy` cheap
+        code = "import sys, twiggy; print ' '.join(sorted(sys.modules))"
+        env = dict(os.environ)
+        env.pop('TWIGGY_UNDER_TEST', None)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(twiggy.__file__)))
+        modules = subprocess.check_output([sys.executable, '-c', code], env=env).split()
+        assert 'twiggy' in modules
+        for heavy in ('multiprocessing', 'fnmatch', 'timeit', 'logging'):
+            assert heavy not in modules, heavy
 
         
                 
@@ -1,5 +1,7 @@
 import unittest
 import sys
+import pickle
+import logging
 
 from twiggy import levels
 
@@ -75,8 +77,23 @@ class LevelTestCase(unittest.TestCase):
     def test_bogus_not_equals(self):
         assert levels.DEBUG != 1
 
-    @unittest.skipIf(sys.version_info < (3,), "Python 2.x comparisons are insane")
-    def test_bogus_compare(self):
-        # XXX is there a comparable test for 2.x?
-        with self.assertRaises(TypeError):
-            levels.DEBUG < 42
+    def test_int(self):
+        assert isinstance(levels.DEBUG, int)
+        assert levels.DEBUG == logging.DEBUG
+        assert levels.INFO == logging.INFO
+        assert levels.WARNING == logging.WARNING
+        assert levels.ERROR == logging.ERROR
+        assert levels.CRITICAL == logging.CRITICAL
+        assert logging.INFO < levels.NOTICE < logging.WARNING
+        assert levels.DISABLED > logging.CRITICAL
+
+    def test_format(self):
+        assert "{0}".format(levels.INFO) == 'INFO'
+        assert "%s" % levels.INFO == 'INFO'
+        assert "{0:<8}|".format(levels.INFO) == 'INFO    |'
+        assert "{0:>7}".format(levels.DEBUG) == '  DEBUG'
+        assert format(levels.INFO, '') == 'INFO'
+
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            assert pickle.loads(pickle.dumps(levels.ERROR, protocol)) is levels.ERROR
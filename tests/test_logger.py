@@ -1,8 +1,11 @@
 import unittest
 import sys
+import os
+import subprocess
+import tempfile
 import StringIO
 
-from twiggy import logger, outputs, levels, filters
+from twiggy import logger, outputs, levels, filters, formats, context, message
 import twiggy as _twiggy
 
 class LoggerTestBase(object):
@@ -41,6 +44,18 @@ class LoggerTestBase(object):
         assert log is not self.log
         assert log._options['trace'] == 'error'
 
+    def test_trace_depth(self):
+        log = self.log.trace('always', depth=3)
+        assert log._options['trace'] == 'always'
+        assert log._options['trace_depth'] == 3
+
+    def test_trace_always(self):
+        self.log.trace('always').info('hi')
+        m = self.messages.pop()
+        assert m.traceback.startswith('Stack (most recent call last):\n')
+        # frames inside twiggy are skipped
+        assert m.traceback.endswith("in test_trace_always\n    self.log.trace('always').info('hi')\n")
+
     def test_debug(self):
         self.log.debug('hi')
         assert len(self.messages) == 1
@@ -221,6 +236,96 @@ class LoggerTestCase(LoggerTestBase, unittest.TestCase):
         self.log.debug('hi')
         assert len(self.messages) == 0
     
+    def test_reconfigure_while_emitting(self):
+        def reconfigure(msg):
+            # used to raise "dictionary changed size during iteration"
+            self.emitters['z'] = filters.Emitter(levels.DEBUG, None, self.output)
+            return True
+        self.emitters['a'] = filters.Emitter(levels.DEBUG, reconfigure, self.output)
+
+        self.log.debug('hi')
+        assert len(self.messages) == 1
+        assert sorted(self.emitters) == ['*', 'a', 'z']
+        self.log.debug('hi')
+        assert len(self.messages) == 2
+
+    def test_pre_filter(self):
+        created = []
+        def who():
+            created.append(1)
+            return 'x'
+
+        self.emitters['*'].filter = filters.names('alice')
+        self.log.name('bob').fields(who=who).info('hi')
+        assert not created
+        assert not self.messages
+
+        self.log.name('alice').fields(who=who).info('hi')
+        assert created
+        assert len(self.messages) == 1
+
+    def test_pre_filter_some(self):
+        out = outputs.ListOutput(close_atexit=False)
+        self.emitters['bob'] = filters.Emitter(levels.DEBUG, None, out,
+                                               pre_filter=lambda level, fields: level >= levels.ERROR)
+        self.log.info('hi')
+        self.log.error('hi')
+        assert len(self.messages) == 2
+        assert len(out.messages) == 1
+
+    def test_unused_callables(self):
+        called = []
+        def expensive():
+            called.append(1)
+            return 42
+
+        self.emitters['*'] = filters.Emitter(levels.DEBUG, None, outputs.NullOutput(close_atexit=False))
+        self.log.fields(answer=expensive).info('hi')
+        assert not called
+
+        self.emitters['list'] = filters.Emitter(levels.DEBUG, None, self.output)
+        self.log.fields(answer=expensive).info('hi')
+        assert called
+        assert self.messages[0].fields['answer'] == 42
+
+    def test_unused_callables_dropped(self):
+        sio = StringIO.StringIO()
+        self.emitters['*'] = filters.Emitter(levels.DEBUG, None, outputs.StreamOutput(formats.shell_format, sio))
+        self.log.fields(time=lambda: 1/0).info('hi')
+        assert sio.getvalue() == 'INFO|hi\n'
+
+    def test_logger_filter_cache(self):
+        calls = []
+        def filt(format_spec):
+            calls.append(format_spec)
+            return 'pants' in format_spec
+        self.log.filter = filt
+
+        for i in range(3):
+            self.log.debug('pants')
+            self.log.name('bob').debug('shirt')
+        assert calls == ['pants', 'shirt']
+        assert len(self.messages) == 3
+
+        # reassigning clears the cache
+        self.log.filter = lambda format_spec: 'shirt' in format_spec
+        self.log.debug('pants')
+        self.log.debug('shirt')
+        assert len(self.messages) == 4
+
+        # unhashable format_specs aren't cached
+        class Unhashable(str):
+            __hash__ = None
+        self.log.filter = lambda format_spec: True
+        self.log.debug(Unhashable('pants'))
+        assert len(self.messages) == 5
+
+    def test_plain_dict_emitters(self):
+        log = logger.Logger(emitters={'*': filters.Emitter(levels.DEBUG, None, self.output)})
+        assert isinstance(log._emitters, filters.Emitters)
+        log.debug('hi')
+        assert len(self.messages) == 1
+
     def test_logger_filter(self):
         self.log.filter = lambda fmt_spec: 'pants' in fmt_spec
         self.log.debug('hi')
@@ -232,6 +337,228 @@ class LoggerTestCase(LoggerTestBase, unittest.TestCase):
         m = self.messages.pop()
         assert m.text == 'hi'
 
+    def test_caller(self):
+        log = self.log.options(caller=True)
+        line = sys._getframe().f_lineno + 1
+        log.info('hi')
+        log.struct(x=1)
+        m = self.messages.pop(0)
+        assert m.fields['file'] == 'test_logger.py'
+        assert m.fields['line'] == line
+        assert m.fields['func'] == 'test_caller'
+
+        # emit decorators are one level deeper
+        m = self.messages.pop(0)
+        assert m.fields['line'] == line + 1
+        assert m.fields['func'] == 'test_caller'
+
+    def test_template(self):
+        tmpl = self.log.name('db').template(levels.INFO, "query {table} took {ms}ms")
+        assert tmpl.level == levels.INFO
+        tmpl(table='users', ms=42)
+        tmpl(table='pants', ms=1)
+        assert len(self.messages) == 2
+        m = self.messages.pop(0)
+        assert m.text == 'query users took 42ms'
+        assert m.name == 'db'
+        assert m.level == levels.INFO
+        assert self.messages.pop(0).text == 'query pants took 1ms'
+
+    def test_template_styles(self):
+        self.log.options(style='%').template(levels.INFO, "%s %d")('a', 1)
+        self.log.options(style='$').template(levels.INFO, "$x!")(x='y')
+        assert [m.text for m in self.messages] == ['a 1', 'y!']
+
+        with self.assertRaises(ValueError):
+            self.log.options(style='pants').template(levels.INFO, 'hi')
+
+    def test_template_constant(self):
+        tmpl = self.log.options(style='percent').template(levels.INFO, "100%% done")
+        assert tmpl._text == "100% done"
+        tmpl()
+        tmpl()
+        assert [m.text for m in self.messages] == ["100% done"] * 2
+
+        # still formatted when given args
+        self.log.template(levels.INFO, "{{x}}")()
+        self.log.template(levels.INFO, "hi")('ignored')
+        assert [m.text for m in self.messages[2:]] == ["{x}", "hi"]
+
+        assert self.log.template(levels.INFO, "{0}")._text is None
+
+    def test_template_resolved_once(self):
+        calls = []
+        def filt(format_spec):
+            calls.append(format_spec)
+            return format_spec != 'no'
+        log = self.log.fields(x=1)
+        log.filter = filt
+
+        yes = log.template(levels.INFO, 'yes')
+        no = log.template(levels.INFO, 'no')
+        low = log.template(levels.DEBUG, 'yes')
+        log.min_level = levels.INFO
+        low2 = log.template(levels.DEBUG, 'yes')
+
+        # later changes to the logger aren't seen
+        log.filter = lambda format_spec: False
+        log._fields['x'] = 2
+
+        for i in range(3):
+            yes(); no(); low(); low2()
+        assert calls == ['yes', 'no']
+        assert [m.text for m in self.messages] == ['yes', 'yes'] * 3
+        assert all(m.fields['x'] == 1 for m in self.messages)
+
+        # but emitters are
+        self.emitters['*'].min_level = levels.WARNING
+        yes()
+        assert len(self.messages) == 6
+
+    def test_template_caller(self):
+        tmpl = self.log.options(caller=True).template(levels.INFO, "hi")
+        line = sys._getframe().f_lineno + 1
+        tmpl()
+        m = self.messages.pop()
+        assert m.fields['line'] == line
+        assert m.fields['func'] == 'test_template_caller'
+
+    def assertDisabled(self, log, *names):
+        for name in ('debug', 'info', 'notice', 'warning', 'error', 'critical'):
+            func = getattr(log, name).__func__
+            if name in names:
+                assert func is logger._disabled_methods[name], name
+            else:
+                assert func is getattr(logger.BaseLogger, name).__func__, name
+
+    def test_disabled_methods(self):
+        self.assertDisabled(self.log)
+        assert isinstance(self.log, logger.Logger)
+        assert type(self.log).__name__ == 'Logger'
+
+        # by the logger's min_level, without affecting others
+        log = self.log.name('bob')
+        log.min_level = levels.NOTICE
+        self.assertDisabled(log, 'debug', 'info')
+        self.assertDisabled(self.log)
+        self.assertDisabled(log.fields(x=1), 'debug', 'info')
+        log.debug('hi')
+        assert len(self.messages) == 0
+        log.notice('hi')
+        assert len(self.messages) == 1
+
+        # by the emitters' min_level
+        self.emitters['*'].min_level = levels.INFO
+        self.assertDisabled(self.log, 'debug')
+        self.emitters['other'] = filters.Emitter(levels.ERROR, None, self.output)
+        self.assertDisabled(self.log, 'debug')
+        self.emitters['*'].min_level = levels.WARNING
+        self.assertDisabled(self.log, 'debug', 'info', 'notice')
+        self.assertDisabled(log, 'debug', 'info', 'notice')
+
+        # restored when lowered
+        self.emitters['*'].min_level = levels.DEBUG
+        self.assertDisabled(self.log)
+        self.assertDisabled(log, 'debug', 'info')
+
+        # everything disabled without emitters
+        self.emitters.clear()
+        self.assertDisabled(self.log, 'debug', 'info', 'notice', 'warning', 'error', 'critical')
+        self.emitters.replace({'*': filters.Emitter(levels.DEBUG, None, self.output)}, close=False)
+        self.assertDisabled(self.log)
+
+    def test_disabled_methods_result(self):
+        names = ('debug', 'info', 'notice', 'warning', 'error', 'critical')
+        enabled = [getattr(self.log, name)('hi') for name in names]
+        assert enabled[2] is True
+
+        log = self.log._clone()
+        log.min_level = levels.DISABLED
+        self.assertDisabled(log, *names)
+        assert [getattr(log, name)('hi') for name in names] == enabled
+
+    def test_disabled_methods_subclass(self):
+        class MyLogger(logger.Logger):
+            __slots__ = ()
+            def info(self, format_spec='', *args, **kwargs):
+                return super(MyLogger, self).info("my " + format_spec, *args, **kwargs)
+
+        log = MyLogger(emitters=self.emitters)
+        assert isinstance(log, MyLogger)
+        log.info('hi')
+        assert self.messages.pop().text == 'my hi'
+
+        log.min_level = levels.WARNING
+        assert log.info.__func__ is logger._disabled_methods['info']
+        log.min_level = levels.DEBUG
+        assert log.info.__func__ is MyLogger.__dict__['info']
+        log.name('bob').info('hi')
+        assert self.messages.pop().text == 'my hi'
+
+    def test_caller_fast_path(self):
+        skipped = []
+        def skip(f, orig=message._skip_twiggy_frames):
+            skipped.append(f)
+            return orig(f)
+        self.addCleanup(setattr, message, '_skip_twiggy_frames', message._skip_twiggy_frames)
+        message._skip_twiggy_frames = skip
+
+        log = self.log.options(caller=True)
+        line = sys._getframe().f_lineno + 1
+        log.info('hi')
+        m = self.messages.pop()
+        assert m.fields['line'] == line
+        assert m.fields['func'] == 'test_caller_fast_path'
+        assert skipped == []
+
+        log.struct(x=1)
+        m = self.messages.pop()
+        assert m.fields['line'] == line + 6
+        assert skipped == []
+
+        # templates take the slow path
+        log.template(levels.INFO, 'hi')()
+        m = self.messages.pop()
+        assert m.fields['func'] == 'test_caller_fast_path'
+        assert len(skipped) == 1
+
+    def test_caller_module_level(self):
+        # a script's top-level frame has no f_back
+        code = "\n".join(["from twiggy import logger, filters, levels, outputs",
+                          "out = outputs.ListOutput(close_atexit=False)",
+                          "log = logger.Logger(emitters={'*': filters.Emitter(levels.DEBUG, None, out)})",
+                          "log.options(caller=True).info('hi')",
+                          "m = out.messages[0]",
+                          "print m.fields['line'], m.fields['func']"])
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        # twiggy imported by absolute path, then relative to the working directory
+        for cwd, env in [(tempfile.gettempdir(), dict(os.environ, PYTHONPATH=root)),
+                         (root, dict((k, v) for k, v in os.environ.items() if k != 'PYTHONPATH'))]:
+            proc = subprocess.Popen([sys.executable, '-c', code], cwd=cwd, env=env,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = proc.communicate()
+            assert proc.returncode == 0, err
+            assert out == "4 <module>\n", (cwd, out, err)
+
+    def test_partial_options(self):
+        # options dicts from before caller was added
+        log = logger.Logger(options={'suppress_newlines': True, 'trace': None, 'style': 'braces'},
+                            emitters=self.emitters)
+        log.info('hi')
+        assert self.messages.pop().text == 'hi'
+
+    def test_context_fields(self):
+        log = self.log.fields(a=1)
+        with context.bind(a=0, request_id=42):
+            log.debug('hi')
+        log.debug('bye')
+
+        m = self.messages.pop(0)
+        self.assertDictContainsSubset({'a':1, 'request_id':42}, m.fields)
+        m = self.messages.pop(0)
+        assert 'request_id' not in m.fields
+        assert log._fields == {'a':1}
+
 class LoggerTrapTestCase(unittest.TestCase):
 
     
@@ -386,3 +713,18 @@ class LoggerTrapTestCase(unittest.TestCase):
         
         
 
+    def test_trap_pre_filter(self):
+        def go_boom(level, fields):
+            raise RuntimeError("BOOM")
+
+        self.emitters['everything'].pre_filter = go_boom
+        self.log.fields().info('hi')
+
+        # errors in pre-filtering cause messages to be output anyway
+        assert len(self.messages) == 1
+        assert len(self.internal_messages) == 1
+        m = self.internal_messages.pop()
+        assert m.level == levels.INFO
+        assert "Error pre-filtering with emitter everything" in m.text
+        assert "<function go_boom" in m.text
+        assert "BOOM" in m.traceback
@@ -5,9 +5,12 @@ sys.modules.pop('twiggy', None)
 os.environ.pop('TWIGGY_UNDER_TEST', None) # we need globals!!
 from twiggy import logging_compat, add_emitters, log
 from twiggy.outputs import ListOutput
+from twiggy.filters import Emitter, Emitters
+from twiggy.logger import Logger
 from twiggy.logging_compat import (hijack, restore, basicConfig,
-                                   getLogger, root, DEBUG, INFO, ERROR,
-                                   LoggingBridgeOutput, LoggingBridgeFormat,
+                                   getLogger, root, FakeLogger, DEBUG, INFO,
+                                   NOTICE, WARNING, ERROR, CRITICAL,
+                                   LoggingBridgeOutput, LoggingBridgeFormat, TwiggyHandler,
                                    orig_logging)
 
 class HijackTest(TestCase):
@@ -78,6 +81,27 @@ class TestFakeLogger(TestCase):
         self.logger.setLevel(DEBUG)
         self.failUnless(self.logger.isEnabledFor(DEBUG))
 
+    def test_isEnabledFor_emitters(self):
+        emitters = Emitters()
+        logger = FakeLogger(Logger(emitters=emitters))
+        self.failIf(logger.isEnabledFor(CRITICAL))
+
+        emitters['a'] = Emitter(ERROR, None, self.list_output)
+        self.failIf(logger.isEnabledFor(INFO))
+        self.failUnless(logger.isEnabledFor(ERROR))
+        self.failUnlessEqual(logger.getEffectiveLevel(), ERROR)
+
+        emitters['b'] = Emitter(INFO, None, self.list_output)
+        self.failUnless(logger.isEnabledFor(INFO))
+
+        emitters['b'].min_level = WARNING
+        self.failIf(logger.isEnabledFor(INFO))
+        self.failUnlessEqual(logger.getEffectiveLevel(), WARNING)
+
+        logger.setLevel(CRITICAL)
+        self.failIf(logger.isEnabledFor(ERROR))
+        self.failUnlessEqual(logger.getEffectiveLevel(), CRITICAL)
+
     def test_log_no_exc_info(self):
         self.logger.info("nothing", exc_info=True)
         self.failUnlessEqual(self.messages[0].traceback, None)
@@ -111,8 +135,120 @@ class TestLoggingBridge(TestCase):
         logger.error("eggs")
         self.failUnlessEqual(messages[0], ('|eggs\n', ERROR, 'spam'))
         
+    def test_format_fields(self):
+        list_output = ListOutput(format=LoggingBridgeFormat(), close_atexit=False)
+        logger = Logger(emitters={'*': Emitter(DEBUG, None, list_output)})
+        logger.name("spam").fields(pants=42).error("eggs")
+        self.failUnlessEqual(list_output.messages[0], ('pants=42|eggs\n', ERROR, 'spam'))
+
     def test_sanity(self):
         logger = log.name("decoy")
         add_emitters(("decoy", DEBUG, None, LoggingBridgeOutput()))
         logger.error("spam")
         logger.notice("eggs")
+
+    def test_structured(self):
+        records = []
+        class ListHandler(orig_logging.Handler):
+            def emit(self, record):
+                records.append(record)
+
+        stdlib_logger = orig_logging.getLogger("bridged")
+        stdlib_logger.propagate = False
+        stdlib_logger.setLevel(orig_logging.INFO)
+        handler = ListHandler()
+        stdlib_logger.addHandler(handler)
+        self.addCleanup(stdlib_logger.removeHandler, handler)
+
+        output = LoggingBridgeOutput(close_atexit=False)
+        formatted = []
+        def format(msg):
+            formatted.append(msg)
+            return msg
+        output._format = format
+
+        logger = Logger(emitters={'bridged': Emitter(DEBUG, None, output)}).name("bridged").fields(pants=42)
+        logger.debug("bridged skipped")
+        self.failUnlessEqual(records, [])
+        self.failUnlessEqual(formatted, [])
+
+        try:
+            1/0
+        except ZeroDivisionError:
+            logger.trace().notice("bridged {0}", "eggs")
+
+        self.failUnlessEqual(len(records), 1)
+        record = records[0]
+        self.failUnlessEqual(record.name, "bridged")
+        self.failUnlessEqual(record.levelno, orig_logging.WARNING)
+        self.failUnlessEqual(record.getMessage(), "bridged eggs")
+        self.failUnlessEqual(record.pants, 42)
+        self.failUnless(record.exc_text.endswith("ZeroDivisionError: integer division or modulo by zero"))
+        self.failUnless(orig_logging.Formatter().format(record).startswith("bridged eggs\nTraceback"))
+
+class TestTwiggyHandler(TestCase):
+
+    def setUp(self):
+        self.list_output = ListOutput(close_atexit=False)
+        self.messages = self.list_output.messages
+        self.logger = Logger(emitters={'*': Emitter(DEBUG, None, self.list_output)})
+        self.handler = TwiggyHandler(self.logger)
+
+        self.stdlib_logger = orig_logging.getLogger("handled")
+        self.stdlib_logger.propagate = False
+        self.stdlib_logger.setLevel(orig_logging.DEBUG)
+        self.stdlib_logger.addHandler(self.handler)
+        self.addCleanup(self.stdlib_logger.removeHandler, self.handler)
+
+    def test_emit(self):
+        self.stdlib_logger.info("eggs %s %d", "spam", 42)
+        m = self.messages.pop()
+        self.failUnlessEqual(m.text, "eggs spam 42")
+        self.failUnlessEqual(m.name, "handled")
+        self.failUnlessEqual(m.level, INFO)
+
+        self.stdlib_logger.warning("%(who)s", {'who': "spam"})
+        self.failUnlessEqual(self.messages.pop().text, "spam")
+
+        # no args, no formatting
+        self.stdlib_logger.error("100%")
+        self.failUnlessEqual(self.messages.pop().text, "100%")
+
+    def test_levels(self):
+        self.stdlib_logger.setLevel(1)
+        for stdlib_level, level in [(1, DEBUG), (orig_logging.INFO, INFO), (25, NOTICE),
+                                    (35, WARNING), (orig_logging.CRITICAL, CRITICAL), (99, CRITICAL)]:
+            self.stdlib_logger.log(stdlib_level, "spam")
+            self.failUnlessEqual(self.messages.pop().level, level)
+
+    def test_exc_info(self):
+        try:
+            1/0
+        except ZeroDivisionError:
+            self.stdlib_logger.exception("spam")
+        m = self.messages.pop()
+        self.failUnlessEqual(m.level, ERROR)
+        self.failUnless("ZeroDivisionError" in m.traceback)
+
+    def test_cache(self):
+        self.stdlib_logger.info("spam")
+        self.stdlib_logger.info("eggs")
+        self.failUnlessEqual(list(self.handler._loggers), ["handled"])
+
+    def test_no_lock(self):
+        self.failUnless(self.handler.lock is None)
+        self.stdlib_logger.info("spam")
+        self.failUnlessEqual(self.messages.pop().text, "spam")
+
+    def test_caller(self):
+        handler = TwiggyHandler(self.logger.options(caller=True))
+        self.stdlib_logger.removeHandler(self.handler)
+        self.stdlib_logger.addHandler(handler)
+        self.addCleanup(self.stdlib_logger.removeHandler, handler)
+
+        line = sys._getframe().f_lineno + 1
+        self.stdlib_logger.info("spam")
+        m = self.messages.pop()
+        self.failUnlessEqual(m.fields['file'], os.path.basename(__file__).replace('.pyc', '.py'))
+        self.failUnlessEqual(m.fields['line'], line)
+        self.failUnlessEqual(m.fields['func'], 'test_caller')
@@ -1,7 +1,12 @@
 import unittest
 import sys
+import pickle
+import collections
+import traceback
+import weakref
 
 import twiggy.levels
+from twiggy import message
 from twiggy.message import Message
 
 from . import make_mesg
@@ -314,3 +319,144 @@ and shirt'''
 
         assert m.traceback.startswith('Traceback (most recent call last):')
         assert m.traceback.endswith('ZeroDivisionError: integer division or modulo by zero\n')
+
+    def test_trace_lazy(self):
+        opts = Message._default_options.copy()
+        opts['trace'] = 'error'
+
+        try:
+            1/0
+        except ZeroDivisionError:
+            expected = traceback.format_exc()
+            m = Message(twiggy.levels.DEBUG, "Hello", {}, opts, (), {})
+
+        assert m._traceback is None
+        assert m._exc_info is not None
+        assert m.traceback == expected
+        assert m._exc_info is None
+        assert m.traceback == expected
+
+    def test_trace_no_frames(self):
+        opts = Message._default_options.copy()
+        opts['trace'] = 'error'
+
+        class Request(object):
+            pass
+
+        def handle():
+            request = Request()
+            ref = weakref.ref(request)
+            try:
+                1/0
+            except ZeroDivisionError:
+                return ref, Message(twiggy.levels.DEBUG, "Hello", {}, opts, (), {})
+
+        ref, m = handle()
+        # the raising frame, and its locals, aren't kept alive
+        assert ref() is None
+        assert m.traceback.endswith('ZeroDivisionError: integer division or modulo by zero\n')
+        assert 'in handle\n' in m.traceback
+
+    def test_trace_cache(self):
+        opts = Message._default_options.copy()
+        opts['trace'] = 'error'
+        message._trace_cache.clear()
+
+        msgs = []
+        for i in range(2):
+            try:
+                raise RuntimeError(i)
+            except RuntimeError:
+                msgs.append(Message(twiggy.levels.DEBUG, "Hello", {}, opts, (), {}))
+
+        assert msgs[0].traceback.endswith("RuntimeError: 0\n")
+        assert msgs[1].traceback.endswith("RuntimeError: 1\n")
+        assert len(message._trace_cache) == 1
+
+    def test_trace_pickle(self):
+        opts = Message._default_options.copy()
+        opts['trace'] = 'error'
+
+        try:
+            1/0
+        except ZeroDivisionError:
+            m = Message(twiggy.levels.DEBUG, "Hello", {'level':twiggy.levels.DEBUG}, opts, (), {})
+
+        m2 = pickle.loads(pickle.dumps(m, pickle.HIGHEST_PROTOCOL))
+        assert m2.traceback == m.traceback
+        assert m2.text == m.text
+        assert m2.fields == m.fields
+
+    def test_trace_always(self):
+        opts = Message._default_options.copy()
+        opts['trace'] = 'always'
+
+        def outer():
+            return inner()
+
+        def inner():
+            return Message(twiggy.levels.DEBUG, "Hello", {}, opts, (), {})
+
+        m = outer()
+        assert m._stack[-1][2] == 'inner'
+        assert m._stack[-2][2] == 'outer'
+        assert m._stack[-3][2] == 'test_trace_always'
+
+        tb = m.traceback
+        assert tb.startswith('Stack (most recent call last):\n')
+        assert 'return inner()' in tb
+        assert tb.endswith('in inner\n    return Message(twiggy.levels.DEBUG, "Hello", {}, opts, (), {})\n')
+        assert m._stack is None
+
+    def test_trace_always_depth(self):
+        opts = Message._default_options.copy()
+        opts['trace'] = 'always'
+        opts['trace_depth'] = 1
+
+        m = Message(twiggy.levels.DEBUG, "Hello", {}, opts, (), {})
+        assert len(m._stack) == 1
+        assert m._stack[0][2] == 'test_trace_always_depth'
+
+    def test_trace_always_old_options(self):
+        # options dicts from before trace_depth was added
+        opts = {'suppress_newlines': True, 'trace': 'always', 'style': 'braces', 'caller': False}
+        m = Message(twiggy.levels.DEBUG, "Hello", {}, opts, (), {})
+        assert m._stack[-1][2] == 'test_trace_always_old_options'
+
+class FieldsViewTestCase(unittest.TestCase):
+
+    def test_mapping(self):
+        m = make_mesg()
+        f = m.fields
+        assert isinstance(f, collections.Mapping)
+        assert f['shirt'] == 42
+        assert 'shirt' in f
+        assert 'pants' not in f
+        assert f.get('pants', 'none') == 'none'
+        assert len(f) == 3
+        assert sorted(f) == ['level', 'name', 'shirt']
+        assert dict(f) == f.copy() == {'shirt':42, 'name': 'jose', 'level':twiggy.levels.DEBUG}
+        with self.assertRaises(KeyError):
+            f['pants']
+
+    def test_read_only(self):
+        m = make_mesg()
+        with self.assertRaises(TypeError):
+            m.fields['shirt'] = 43
+        assert not hasattr(m.fields, '__dict__')
+
+    def test_shared_keys(self):
+        m1 = make_mesg()
+        m2 = make_mesg(shirt=43)
+        assert m1.fields._keys is m2.fields._keys
+        assert m2.fields['shirt'] == 43
+        assert make_mesg(pants=1).fields._keys is not m1.fields._keys
+
+    def test_pickle(self):
+        m = make_mesg()
+        m2 = pickle.loads(pickle.dumps(m, pickle.HIGHEST_PROTOCOL))
+        assert isinstance(m2.fields, message.FieldsView)
+        assert m2.fields == m.fields
+        assert m2.fields._keys is m.fields._keys
+        assert m2.text == m.text
+        assert m2.traceback is None
@@ -0,0 +1,129 @@
+import unittest
+import threading
+import tempfile
+import os
+
+from twiggy import metrics, logger, outputs, filters, levels, formats
+
+from . import when
+
+class CountersTestCase(unittest.TestCase):
+
+    def test_incr(self):
+        c = metrics.Counters()
+        c.incr('a')
+        c.incr('a', 2)
+        c.incr(('emitted', 'INFO'))
+        assert c.snapshot() == {'a':3, ('emitted', 'INFO'):1}
+
+        c.clear()
+        assert c.snapshot() == {}
+
+    def test_threads(self):
+        c = metrics.Counters()
+        def go():
+            for i in range(100):
+                c.incr('a')
+
+        threads = [threading.Thread(target=go) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        go()
+        assert c.snapshot() == {'a':500}
+        # exited threads' counts are folded together
+        assert len(c._all) == 1
+
+    def test_many_threads(self):
+        c = metrics.Counters()
+        def go():
+            c.incr('a')
+            c.incr(('emitted', 'INFO'), 2)
+
+        for i in range(50):
+            t = threading.Thread(target=go)
+            t.start()
+            t.join()
+            assert len(c._all) <= 2
+        assert c.snapshot() == {'a':50, ('emitted', 'INFO'):100}
+        assert c._all == []
+
+        c.clear()
+        assert c.snapshot() == {}
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        metrics.enabled = True
+        metrics.logger.clear()
+        self.log = logger.Logger(fields={'time':when}, min_level=levels.INFO)
+        self.emitters = self.log._emitters
+        self.output = outputs.StreamOutput(formats.shell_format, stream=open(os.devnull, 'w'))
+        self.emitters['all'] = filters.Emitter(levels.INFO, filters.names('a'), self.output)
+        self.emitters['errors'] = filters.Emitter(levels.ERROR, None, outputs.ListOutput(close_atexit=False))
+
+    def tearDown(self):
+        metrics.enabled = False
+        metrics.logger.clear()
+        self.output.stream.close()
+
+    def test_snapshot(self):
+        self.log.debug('no')
+        self.log.name('a').info('hi')
+        self.log.name('b').info('hi')
+        self.log.name('a').error('boom')
+        self.log.filter = lambda fmt: False
+        self.log.info('filtered')
+
+        snap = metrics.snapshot(self.emitters)
+        assert snap['logger'] == {'considered':5, 'rejected_level':1, 'rejected_filter':1,
+                                  ('emitted', 'INFO'):1, ('emitted', 'ERROR'):1}
+
+        e = snap['emitters']['all']
+        assert e[('emitted', 'INFO')] == 1
+        assert e[('emitted', 'ERROR')] == 1
+        assert e['rejected_filter'] == 1
+        assert e['output']['messages'] == 2
+        assert e['output']['bytes_written'] == len("INFO:a|hi\nERROR:a|boom\n")
+        assert e['output']['dropped'] == 0
+
+        e = snap['emitters']['errors']
+        assert e['rejected_level'] == 2
+        assert e[('emitted', 'ERROR')] == 1
+        assert e['output'] == {'messages':1}
+
+    def test_template(self):
+        self.log.template(levels.DEBUG, 'no')()
+        self.log.name('a').template(levels.INFO, 'hi')()
+        self.log.filter = lambda fmt: False
+        self.log.template(levels.INFO, 'filtered')()
+
+        snap = metrics.snapshot(self.emitters)
+        assert snap['logger'] == {'considered':3, 'rejected_level':1, 'rejected_filter':1,
+                                  ('emitted', 'INFO'):1}
+
+    def test_disabled(self):
+        metrics.enabled = False
+        self.log.name('a').info('hi')
+        snap = metrics.snapshot(self.emitters)
+        assert snap['logger'] == {}
+        assert snap['emitters']['all']['output'] == {'dropped':0}
+
+    def test_prometheus(self):
+        self.log.name('a').error('boom')
+        text = metrics.format_prometheus(metrics.snapshot(self.emitters))
+        lines = text.splitlines()
+        assert 'twiggy_logger_considered_total 1' in lines
+        assert 'twiggy_logger_emitted_total{level="ERROR"} 1' in lines
+        assert 'twiggy_emitter_emitted_total{emitter="all",level="ERROR"} 1' in lines
+        assert 'twiggy_output_messages_total{emitter="errors"} 1' in lines
+        assert 'twiggy_output_dropped_total{emitter="all"} 0' in lines
+
+    def test_dump(self):
+        fname = tempfile.mktemp()
+        self.addCleanup(os.remove, fname)
+        self.log.name('a').error('boom')
+        metrics.dump(fname, self.emitters)
+        assert open(fname).read() == metrics.format_prometheus(metrics.snapshot(self.emitters))
+        assert not os.path.exists(fname + '.tmp')
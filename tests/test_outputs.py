@@ -2,15 +2,17 @@ import unittest
 import tempfile
 import os
 import StringIO
+import Queue
+import multiprocessing
+import threading
+import time
 
-from twiggy import outputs, formats
+from twiggy import outputs, formats, levels, metrics
 
 from . import make_mesg, when
 
-m = make_mesg()
-
 # just stuff time in fields so we can use an existing format object
-m.fields['time']=when
+m = make_mesg(time=when)
 
 # XXX I can't think of a decent way to test Output/AsyncOutput on their own...
 
@@ -82,10 +84,326 @@ class ListOutputTest(unittest.TestCase):
         assert len(o.messages) == 1
         assert o.messages[0] is m
         
-        m2 = make_mesg()
-        m2.fields['time'] = when
+        m2 = make_mesg(time=when)
         
         o.output(m2)
         assert o.messages[1] is m2
         o.close()
         assert not o.messages
+
+class RingBufferOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.target = outputs.ListOutput(close_atexit=False)
+        self.output = outputs.RingBufferOutput(self.target, capacity=3, close_atexit=False)
+
+    def tearDown(self):
+        self.output.close()
+        self.target.close()
+
+    def test_buffers_until_trigger(self):
+        for i in range(5):
+            self.output.output(make_mesg(levels.DEBUG, str(i)))
+        assert self.target.messages == []
+
+        self.output.output(make_mesg(levels.ERROR, "boom"))
+        assert [msg.text for msg in self.target.messages] == ['3', '4', 'boom']
+
+        # buffer is emptied after flushing
+        self.output.output(make_mesg(levels.CRITICAL, "again"))
+        assert [msg.text for msg in self.target.messages] == ['3', '4', 'boom', 'again']
+
+    def test_flush(self):
+        self.output.output(make_mesg(levels.INFO, "a"))
+        self.output.output(make_mesg(levels.INFO, "b"))
+        self.output.flush()
+        assert [msg.text for msg in self.target.messages] == ['a', 'b']
+        self.output.flush()
+        assert len(self.target.messages) == 2
+
+    def test_max_bytes(self):
+        o = outputs.RingBufferOutput(self.target, capacity=10, max_bytes=6, close_atexit=False)
+        for text in ("aaa", "bbb", "ccc"):
+            o.output(make_mesg(levels.DEBUG, text))
+        o.flush()
+        assert [msg.text for msg in self.target.messages] == ['bbb', 'ccc']
+
+    def test_close(self):
+        self.output.output(make_mesg(levels.INFO, "a"))
+        self.output.close()
+        assert self.target.messages == []
+
+        o = outputs.RingBufferOutput(self.target, flush_on_close=True, close_atexit=False)
+        o.output(make_mesg(levels.INFO, "a"))
+        o.close()
+        assert [msg.text for msg in self.target.messages] == ['a']
+
+    def test_bad_capacity(self):
+        with self.assertRaises(ValueError):
+            outputs.RingBufferOutput(self.target, capacity=0)
+
+class FingersCrossedOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.target = outputs.ListOutput(close_atexit=False)
+        self.output = outputs.FingersCrossedOutput(self.target, max_messages=2, max_groups=2,
+                                                   close_atexit=False)
+
+    def tearDown(self):
+        self.output.close()
+        self.target.close()
+
+    def texts(self):
+        return [msg.text for msg in self.target.messages]
+
+    def test_no_group(self):
+        self.output.output(make_mesg(levels.DEBUG, "loose"))
+        assert self.texts() == ['loose']
+
+    def test_finish_discards(self):
+        self.output.output(make_mesg(levels.DEBUG, "a", request_id=1))
+        self.output.finish(1)
+        self.output.output(make_mesg(levels.ERROR, "b", request_id=1))
+        assert self.texts() == ['b']
+
+    def test_trigger(self):
+        for text in ("a", "b", "c"):
+            self.output.output(make_mesg(levels.DEBUG, text, request_id=1))
+        self.output.output(make_mesg(levels.DEBUG, "other", request_id=2))
+        assert self.texts() == []
+
+        self.output.output(make_mesg(levels.ERROR, "boom", request_id=1))
+        assert self.texts() == ['b', 'c', 'boom']
+
+        # triggered groups pass through
+        self.output.output(make_mesg(levels.DEBUG, "after", request_id=1))
+        assert self.texts() == ['b', 'c', 'boom', 'after']
+
+    def test_lru(self):
+        self.output.output(make_mesg(levels.DEBUG, "a", request_id=1))
+        self.output.output(make_mesg(levels.DEBUG, "b", request_id=2))
+        self.output.output(make_mesg(levels.DEBUG, "c", request_id=1))
+        self.output.output(make_mesg(levels.DEBUG, "d", request_id=3))
+        assert list(self.output._groups) == [1, 3]
+
+    def test_timeout(self):
+        self.output.timeout = 0
+        self.output.output(make_mesg(levels.DEBUG, "a", request_id=1))
+        self.output._groups[1][0] -= 1
+        self.output.output(make_mesg(levels.DEBUG, "b", request_id=2))
+        assert list(self.output._groups) == [2]
+
+class ThreadedOutputTest(unittest.TestCase):
+
+    def test_threaded_output(self):
+        target = outputs.ListOutput(close_atexit=False)
+        o = outputs.ThreadedOutput(target, msg_buffer=10, close_atexit=False)
+        o.output(m)
+        o.flush()
+        assert target.messages == [m]
+
+        o.output(m)
+        o.close()
+        assert target.messages == [m, m]
+        assert not o._thread.is_alive()
+
+    def test_format_in_thread(self):
+        sio = StringIO.StringIO()
+        o = outputs.ThreadedOutput(outputs.StreamOutput(formats.shell_format, sio), close_atexit=False)
+        o.output(m)
+        o.close()
+        assert sio.getvalue() == "DEBUG:jose:shirt=42|Hello Mister Funnypants\n"
+
+class StalledOutput(outputs.AsyncOutput):
+    """writes to a file, but waits for ``release`` after the first message"""
+
+    def __init__(self, fname, **kwargs):
+        self.fname = fname
+        self.started = multiprocessing.Event()
+        self.release = multiprocessing.Event()
+        super(StalledOutput, self).__init__(formats.shell_format, close_atexit=False, **kwargs)
+
+    def _open(self):
+        self.file = open(self.fname, 'a', 0)
+
+    def _close(self):
+        self.file.close()
+
+    def _write(self, x):
+        self.file.write(x)
+        self.started.set()
+        self.release.wait()
+
+class AsyncOverflowTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.fname = tempfile.mktemp()
+
+    def tearDown(self):
+        try:
+            os.remove(self.fname)
+        except:
+            pass
+
+    def fill(self, **kwargs):
+        o = StalledOutput(self.fname, msg_buffer=2, **kwargs)
+        o.output(make_mesg(text="1", time=when))
+        o.started.wait(5)
+        o.output(make_mesg(text="2", time=when))
+        o.output(make_mesg(text="3", time=when))
+        return o
+
+    def finish(self, o):
+        o.release.set()
+        o.close()
+        return [line.rsplit('|', 1)[1] for line in open(self.fname).read().splitlines()]
+
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            outputs.AsyncOutput(msg_buffer=1, overflow='explode')
+
+    def test_raise(self):
+        o = self.fill()
+        with self.assertRaises(Queue.Full):
+            o.output(make_mesg(text="4", time=when))
+        assert self.finish(o) == ["1", "2", "3"]
+
+    def test_drop_newest(self):
+        o = self.fill(overflow='drop_newest')
+        o.output(make_mesg(text="4", time=when))
+        assert o.dropped == 1
+        assert self.finish(o) == ["1", "2", "3"]
+
+    def test_drop_oldest(self):
+        o = self.fill(overflow='drop_oldest')
+        o.output(make_mesg(text="4", time=when))
+        assert o.dropped == 1
+        assert self.finish(o) == ["1", "3", "4"]
+
+    def test_block_timeout(self):
+        o = self.fill(overflow='block', timeout=0.01)
+        o.output(make_mesg(text="4", time=when))
+        assert o.dropped == 1
+        assert self.finish(o) == ["1", "2", "3"]
+
+    def test_sample(self):
+        o = self.fill(overflow='sample', sample_rate=2)
+        for i in range(4):
+            o.output(make_mesg(text="x", time=when))
+        assert o.dropped == 4
+        assert self.finish(o) == ["1", "2", "3"]
+
+    def test_max_bytes(self):
+        o = StalledOutput(self.fname, msg_buffer=10, overflow='drop_newest', max_bytes=4)
+        o.output(make_mesg(text="11", time=when))
+        o.started.wait(5)
+        o.output(make_mesg(text="22", time=when))
+        o.output(make_mesg(text="33", time=when))
+        o.output(make_mesg(text="44", time=when))
+        assert o.dropped == 1
+        assert self.finish(o) == ["11", "22", "33"]
+
+class ThreadBufferedOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sio = StringIO.StringIO()
+        self.target = outputs.StreamOutput(formats.shell_format, self.sio)
+
+    def lines(self):
+        return [line.rsplit('|', 1)[1] for line in self.sio.getvalue().splitlines()]
+
+    def test_buffer_size(self):
+        o = outputs.ThreadBufferedOutput(self.target, buffer_size=3, flush_interval=None, close_atexit=False)
+        o.output(make_mesg(text="1", time=when))
+        o.output(make_mesg(text="2", time=when))
+        assert self.sio.getvalue() == ""
+        o.output(make_mesg(text="3", time=when))
+        assert self.lines() == ["1", "2", "3"]
+        o.output(make_mesg(text="4", time=when))
+        o.close()
+        assert self.lines() == ["1", "2", "3", "4"]
+
+    def test_interval(self):
+        o = outputs.ThreadBufferedOutput(self.target, flush_interval=0.01, close_atexit=False)
+        o.output(make_mesg(text="1", time=when))
+        for i in range(100):
+            if self.sio.getvalue():
+                break
+            time.sleep(0.01)
+        assert self.lines() == ["1"]
+        o.close()
+        assert not o._flusher.is_alive()
+
+    def test_threads(self):
+        o = outputs.ThreadBufferedOutput(self.target, buffer_size=7, flush_interval=None, close_atexit=False)
+
+        def go(name):
+            for i in range(50):
+                o.output(make_mesg(text="{0}-{1}".format(name, i), time=when))
+
+        threads = [threading.Thread(target=go, args=(n,)) for n in "abcd"]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        go("main")
+        o.close()
+
+        lines = self.lines()
+        assert len(lines) == 250
+        for name in ("a", "b", "c", "d", "main"):
+            assert [l for l in lines if l.startswith(name + "-")] == \
+                   ["{0}-{1}".format(name, i) for i in range(50)]
+        # dead threads with empty buffers are forgotten
+        assert len(o._buffers) == 1
+
+    def test_file_output(self):
+        fname = tempfile.mktemp()
+        self.addCleanup(os.remove, fname)
+        target = outputs.FileOutput(fname, formats.shell_format, close_atexit=False)
+        o = outputs.ThreadBufferedOutput(target, buffer_size=2, flush_interval=None, close_atexit=False)
+        o.output(make_mesg(text="1", time=when))
+        o.output(make_mesg(text="2", time=when))
+        o.output(make_mesg(text="3", time=when))
+        o.close()
+        target.close()
+        with open(fname) as f:
+            assert [line.rsplit('|', 1)[1] for line in f.read().splitlines()] == ["1", "2", "3"]
+
+    def test_async_target(self):
+        target = outputs.FileOutput(tempfile.mktemp(), formats.shell_format, msg_buffer=10, close_atexit=False)
+        try:
+            with self.assertRaises(ValueError):
+                outputs.ThreadBufferedOutput(target, close_atexit=False)
+        finally:
+            target.close()
+
+    def test_write_error(self):
+        class FlakyOutput(outputs.ListOutput):
+            fail = True
+            def _write(self, x):
+                if self.fail and x.text == "2":
+                    raise RuntimeError("flaky")
+                super(FlakyOutput, self)._write(x)
+
+        target = FlakyOutput(close_atexit=False)
+        o = outputs.ThreadBufferedOutput(target, buffer_size=10, flush_interval=None, close_atexit=False)
+        for text in "123":
+            o.output(make_mesg(text=text))
+        with self.assertRaises(RuntimeError):
+            o.flush()
+        assert [m.text for m in target.messages] == ["1"]
+
+        # unwritten messages are kept for the next flush
+        target.fail = False
+        o.close()
+        assert [m.text for m in target.messages] == ["1", "2", "3"]
+
+    def test_target_metrics(self):
+        metrics.enabled = True
+        self.addCleanup(setattr, metrics, 'enabled', False)
+        o = outputs.ThreadBufferedOutput(self.target, buffer_size=10, flush_interval=None, close_atexit=False)
+        o.output(make_mesg(text="1", time=when))
+        o.close()
+        assert self.target.get_metrics()['messages'] == 1
+        assert self.target.get_metrics()['bytes_written'] == len(self.sio.getvalue())
@@ -0,0 +1,181 @@
+import unittest
+import threading
+
+import twiggy
+from twiggy import profiling, logger, outputs, filters, levels
+
+class TimingsTestCase(unittest.TestCase):
+
+    def test_add(self):
+        t = profiling.Timings()
+        t.add('a', 1.0)
+        t.add('a', 0.5)
+        t.add('b', 2.0)
+        assert t.snapshot() == {'a':(2, 1.5), 'b':(1, 2.0)}
+
+    def test_threads(self):
+        t = profiling.Timings()
+        def go():
+            t.add('a', 1.0)
+            t.add('b', 0.5)
+
+        for i in range(20):
+            th = threading.Thread(target=go)
+            th.start()
+            th.join()
+            assert len(t._all) <= 2
+        assert t.snapshot() == {'a':(20, 20.0), 'b':(20, 10.0)}
+        assert t._all == []
+        # snapshots don't alias the folded total
+        assert t.snapshot() == {'a':(20, 20.0), 'b':(20, 10.0)}
+
+        t.clear()
+        assert t.snapshot() == {}
+
+class ProfilingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        twiggy._populate_globals()
+        profiling.enabled = True
+        profiling.logger.clear()
+        self.log = logger.Logger()
+        self.emitters = self.log._emitters
+        self.output = outputs.ListOutput(close_atexit=False)
+        self.emitters['all'] = filters.Emitter(levels.DEBUG, None, self.output)
+
+    def tearDown(self):
+        profiling.enabled = False
+        profiling.logger.clear()
+        twiggy._del_globals()
+
+    def test_snapshot(self):
+        # the default filter passes everything, and isn't called or timed
+        self.log.filter = lambda format_spec: True
+        self.log.fields(x=lambda: 42).info('hi')
+        self.log.info('there')
+
+        snap = profiling.snapshot(self.emitters)
+        assert sorted(snap['logger']) == ['callables', 'logger_filter', 'message']
+        for count, seconds in snap['logger'].values():
+            assert count == 2
+            assert seconds >= 0
+
+        e = snap['emitters']['all']
+        assert e['filter'][0] == 2
+        assert e['output']['format'][0] == 2
+        assert e['output']['write'][0] == 2
+        assert len(self.output.messages) == 2
+
+    def test_disabled(self):
+        profiling.enabled = False
+        self.log.info('hi')
+        snap = profiling.snapshot(self.emitters)
+        assert snap['logger'] == {}
+        assert snap['emitters']['all'] == {'output':{}}
+
+    def test_report(self):
+        out = outputs.ListOutput(close_atexit=False)
+        twiggy.devel_log.output = out
+        self.log.info('hi')
+        profiling.report(self.emitters)
+
+        stages = [(m.fields['part'], m.fields['stage']) for m in out.messages]
+        assert ('logger', 'message') in stages
+        assert ('emitter', 'filter') in stages
+        assert ('output', 'write') in stages
+        for m in out.messages:
+            assert m.fields['count'] == 1
+
+class HistogramTestCase(unittest.TestCase):
+
+    def test_buckets(self):
+        last = -1
+        for ns in range(0, 5000) + [2**20, 2**20 + 12345, 10**9]:
+            i = profiling._bucket(ns)
+            assert i >= last
+            last = i
+            assert ns <= profiling._bucket_high(i)
+            # log-linear: bucket width is at most 1/8th of the value
+            assert profiling._bucket_high(i) - ns <= ns / 8
+
+    def test_clamp(self):
+        assert profiling._bucket(10**15) == profiling._NBUCKETS - 1
+
+    def test_snapshot(self):
+        h = profiling.Histogram()
+        assert h.snapshot() == {'count':0, 'p50':0, 'p99':0, 'p999':0, 'max':0}
+
+        for i in range(1000):
+            h.record(0.000001)
+        h.record(0.5)
+
+        d = h.snapshot()
+        assert d['count'] == 1001
+        assert 0.000001 <= d['p50'] <= 0.0000011
+        assert 0.000001 <= d['p99'] <= 0.0000011
+        assert d['p999'] == d['p50']
+        assert d['max'] == 0.5
+
+        h.clear()
+        assert h.snapshot()['count'] == 0
+
+    def test_negative(self):
+        h = profiling.Histogram()
+        h.record(-1e-7)
+        h.record(-1e-3)
+        d = h.snapshot()
+        assert d['count'] == 2
+        assert d['p999'] == d['max'] == 0
+
+    def test_threads(self):
+        h = profiling.Histogram()
+        def go(seconds):
+            h.record(seconds)
+            h.record(0.000001)
+
+        for i in range(20):
+            th = threading.Thread(target=go, args=(0.001 * (i + 1),))
+            th.start()
+            th.join()
+            assert len(h._all) <= 2
+        d = h.snapshot()
+        assert d['count'] == 40
+        assert d['max'] == 0.02
+        assert h._all == []
+        assert h.snapshot() == d
+
+        h.clear()
+        assert h.snapshot()['count'] == 0
+
+class LatencyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        profiling.record_latency()
+        self.log = logger.Logger()
+        self.emitters = self.log._emitters
+        self.output = outputs.ListOutput(close_atexit=False)
+        self.emitters['all'] = filters.Emitter(levels.DEBUG, None, self.output)
+
+    def tearDown(self):
+        profiling.record_latency(False)
+        for h in profiling.calls.values():
+            h.clear()
+
+    def test_record_latency(self):
+        assert logger.Logger._emit.im_func is logger.Logger._timed_emit.im_func
+        self.log.info('hi')
+        self.log.info('there')
+        self.log.error('boom')
+
+        snap = profiling.latency_snapshot(self.emitters)
+        assert sorted(snap['calls']) == ['ERROR', 'INFO']
+        assert snap['calls']['INFO']['count'] == 2
+        assert snap['calls']['ERROR']['count'] == 1
+        assert snap['emitters']['all']['output']['INFO']['count'] == 2
+        assert len(self.output.messages) == 3
+
+    def test_off(self):
+        profiling.record_latency(False)
+        assert logger.Logger._emit.im_func is logger.Logger._untimed_emit.im_func
+        self.log.info('hi')
+        assert profiling.latency_snapshot(self.emitters)['calls'] == {}
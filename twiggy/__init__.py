@@ -1,4 +1,4 @@
-__all__=['log', 'emitters', 'add_emitters', 'devel_log', 'filters', 'formats', 'outputs', 'levels', 'quick_setup']
+__all__=['log', 'emitters', 'add_emitters', 'devel_log', 'filters', 'formats', 'outputs', 'levels', 'context', 'metrics', 'profiling', 'quick_setup']
 from datetime import datetime
 import sys
 import os
@@ -8,6 +8,9 @@ import filters
 import formats
 import outputs
 import levels
+import context
+import metrics
+import profiling
 
 
 ## globals creation is wrapped in a function so that we can do sane testing
@@ -0,0 +1,50 @@
+"""Ambient fields, bound to the current thread rather than to a `.Logger`.
+
+Fields bound here are added to every message emitted by :data:`.log` (and
+loggers derived from it) in the current thread. Fields bound on the logger
+itself take precedence.
+
+This lets request-handling middleware bind ``request_id`` once, instead of
+passing bound loggers around::
+
+    with context.bind(request_id=request.id):
+        handle(request)
+"""
+
+__all__ = ['bind', 'bind_dict', 'get_fields', 'clear']
+
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+def get_fields():
+    """return the dictionary of ambient fields for the current thread, or None if there are none.
+
+    The dictionary must not be modified.
+    """
+    return getattr(_local, 'fields', None)
+
+def bind(**kwargs):
+    """bind ambient fields for the duration of a ``with`` block"""
+    return bind_dict(kwargs)
+
+@contextmanager
+def bind_dict(d):
+    """bind ambient fields for the duration of a ``with`` block.
+
+    Use this instead of `.bind` if you have keys which are not valid Python identifiers.
+    """
+    old = getattr(_local, 'fields', None)
+    # never mutate a dict in place; get_fields() may have handed it out
+    new = old.copy() if old else {}
+    new.update(d)
+    _local.fields = new
+    try:
+        yield
+    finally:
+        _local.fields = old
+
+def clear():
+    """remove all ambient fields for the current thread"""
+    _local.fields = None
@@ -1,6 +1,13 @@
 import levels
-import fnmatch
+import outputs
+import metrics
+import profiling
+import twiggy as _twiggy
 import re
+import threading
+import itertools
+import time
+import weakref
 
 __re_type = type(re.compile('foo')) # XXX is there a canonical place for this?
 
@@ -8,9 +15,15 @@ def msg_filter(x):
     """intelligently create a filter"""
     # XXX replace lambdas with nicely-named functions, for debugging
     if x is None:
-        return lambda msg: True
+        f = lambda msg: True
+        f.uses_field = _uses_no_fields
+        return f
     elif isinstance(x, bool):
-        return lambda msg: x
+        f = lambda msg: x
+        f.uses_field = _uses_no_fields
+        if not x:
+            f.pre_filter = lambda level, fields: False
+        return f
     elif isinstance(x, basestring):
         return regex_wrapper(re.compile(x))
     elif isinstance(x, __re_type):
@@ -23,16 +36,34 @@ def msg_filter(x):
         # XXX a dict could be used to filter on fields (w/ callables?)
         raise ValueError("Unknown filter: {0!r}".format(x))
 
+def _uses_field(f, key):
+    """does filter (or output) ``f`` use the field ``key``. True unless it says otherwise."""
+    uses = getattr(f, 'uses_field', None)
+    return uses is None or uses(key)
+
+def _uses_no_fields(key):
+    return False
+
+def _uses_name(key):
+    return key == 'name'
+
 def list_wrapper(l):
     filts = [msg_filter(i) for i in l]
     def wrapped(msg):
         return all(f(msg) for f in filts)
+    wrapped.uses_field = lambda key: any(_uses_field(f, key) for f in filts)
+    pre_filts = [f.pre_filter for f in filts if getattr(f, 'pre_filter', None) is not None]
+    if pre_filts:
+        def pre_filter(level, fields):
+            return all(f(level, fields) for f in pre_filts)
+        wrapped.pre_filter = pre_filter
     return wrapped
 
 def regex_wrapper(regexp):
     assert isinstance(regexp, __re_type)
     def wrapped(msg):
         return regexp.match(msg.text) is not None
+    wrapped.uses_field = _uses_no_fields
     return wrapped
 
 
@@ -41,30 +72,80 @@ def names(*names):
     names_set = set(names)
     def set_names_filter(msg):
         return msg.name in names_set
+    def set_names_pre_filter(level, fields):
+        name = fields.get('name', '')
+        return callable(name) or name in names_set
     set_names_filter.names = names
+    set_names_filter.pre_filter = set_names_pre_filter
+    set_names_filter.uses_field = _uses_name
     return set_names_filter
 
 def glob_names(*names):
     """returns a filter, which gives True if the messsage's name globs those provided."""
+    import fnmatch # only needed here; don't slow down importing twiggy
     # copied from fnmatch.fnmatchcase - for speed
     patterns = [re.compile(fnmatch.translate(pat)) for pat in names]
     def glob_names_filter(msg):
         return any(pat.match(msg.name) is not None for pat in patterns)
+    def glob_names_pre_filter(level, fields):
+        name = fields.get('name', '')
+        return callable(name) or any(pat.match(name) is not None for pat in patterns)
     glob_names_filter.names = names
+    glob_names_filter.pre_filter = glob_names_pre_filter
+    glob_names_filter.uses_field = _uses_name
     return glob_names_filter
 
 
 
+# changed whenever any emitter's min_level is assigned, see `.Emitters.min_level`
+_min_levels_version = 0
+
+# every `.Emitters` by id, to notify when an emitter's min_level is assigned.
+# (they're dicts, so unhashable)
+_all_emitters = weakref.WeakValueDictionary()
+
 class Emitter(object):
-    """Hold and manage an Output and associated filter."""
+    """Hold and manage an Output and associated filter.
 
-    def __init__(self, min_level, filter, output):
+    ``pre_filter`` is a function taking a message's level and a dictionary
+    of its fields *before* the message is created, and returning False if
+    the message shouldn't be emitted. Fields may still be callables, and
+    the dictionary must not be modified. If not given, it's taken from
+    ``filter``'s ``pre_filter`` attribute, if any.
+    """
+
+    def __init__(self, min_level, filter, output, pre_filter=None):
         if not isinstance(min_level, levels.LogLevel):
             raise ValueError("Unknown min_level: {}".format(min_level))
 
         self.min_level = min_level
-        self.filter = filter
+        self.pre_filter = None
         self._output = output
+        self.filter = filter
+        if pre_filter is not None:
+            self.pre_filter = pre_filter
+        #: `.Counters` for this emitter, see `.metrics`
+        self.metrics = metrics.Counters()
+        #: `.Timings` for this emitter, see `.profiling`
+        self.timings = profiling.Timings()
+
+    def __setattr__(self, name, value):
+        # min_level is read for every message, so it's a plain attribute
+        # rather than a property; only assignment pays for invalidation
+        super(Emitter, self).__setattr__(name, value)
+        if name == 'min_level':
+            global _min_levels_version
+            _min_levels_version += 1
+            for emitters in _all_emitters.values():
+                emitters._notify()
+
+    def uses_field(self, key):
+        """does this emitter's filter or output use the field ``key``. Cached, see `.Output.uses_field`."""
+        try:
+            return self._uses_fields[key]
+        except KeyError:
+            uses = self._uses_fields[key] = _uses_field(self._filter, key) or _uses_field(self._output, key)
+            return uses
 
     @property
     def filter(self):
@@ -72,4 +153,177 @@ class Emitter(object):
 
     @filter.setter
     def filter(self, f):
+        old = getattr(self, '_filter', None)
         self._filter = msg_filter(f)
+        self._uses_fields = {}
+        # follow the filter's pre_filter, unless one was set explicitly
+        if self.pre_filter is getattr(old, 'pre_filter', None):
+            self.pre_filter = getattr(self._filter, 'pre_filter', None)
+
+
+class FingersCrossedEmitter(Emitter):
+    """An `.Emitter` that holds back messages until a group of them contains an error.
+
+    ``output`` is wrapped in a `.FingersCrossedOutput`; remaining keyword
+    arguments are passed to it.
+    """
+
+    def __init__(self, min_level, filter, output, key='request_id', pre_filter=None, **kwargs):
+        kwargs.setdefault('close_atexit', False)
+        super(FingersCrossedEmitter, self).__init__(min_level, filter,
+                                                    outputs.FingersCrossedOutput(output, key, **kwargs),
+                                                    pre_filter)
+
+    def finish(self, group):
+        """discard buffered messages for ``group``, which completed without errors"""
+        self._output.finish(group)
+
+
+class Emitters(dict):
+    """A dictionary of emitter name to `.Emitter`, which can be read without locking.
+
+    Loggers don't iterate the dictionary itself. They use `.config`, an
+    immutable tuple of ``(name, emitter)`` pairs sorted by name, which is
+    rebuilt whenever the dictionary is changed. Changing emitters while
+    messages are being logged is therefore safe: each message sees either
+    the old or the new configuration, never half of one.
+
+    Use `.replace` to swap in a whole new configuration at once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Emitters, self).__init__(*args, **kwargs)
+        self._lock = threading.RLock()
+        # (entered, exited) counters of emits using the current configuration.
+        # next() on an itertools.count is atomic, so readers don't need a lock.
+        self._in_flight = (itertools.count(), itertools.count())
+        self._min_level_cache = (None, None, None)
+        # functions called after changes which may affect min_level, see `._notify`
+        self._listeners = []
+        # level-specialized `.Logger` classes for loggers using these emitters, see `.Logger.min_level`
+        self._logger_classes = {}
+        self._rebuild()
+        _all_emitters[id(self)] = self
+
+    def _rebuild(self):
+        """replace `.config` from the dictionary's contents - for internal use"""
+        #: the current configuration, as a tuple of ``(name, emitter)`` sorted by name
+        self.config = tuple(sorted(self.iteritems()))
+        self._notify()
+
+    def _notify(self):
+        """call each of `._listeners`, after emitters or their min_levels change - for internal use"""
+        for listener in self._listeners:
+            listener()
+
+    @property
+    def min_level(self):
+        """the lowest `.Emitter.min_level` of all emitters, or ``DISABLED`` if there are none.
+
+        Cached until emitters are changed or any emitter's min_level is assigned.
+        """
+        config = self.config
+        version = _min_levels_version
+        cached = self._min_level_cache
+        if cached[0] is config and cached[1] == version:
+            return cached[2]
+        min_level = min([e.min_level for name, e in config] or [levels.DISABLED])
+        self._min_level_cache = (config, version, min_level)
+        return min_level
+
+    def _enter(self):
+        """start using `.config`. Returns a token to pass to `._exit` - for internal use"""
+        token = self._in_flight
+        next(token[0])
+        return token
+
+    @staticmethod
+    def _exit(token):
+        """finish using `.config` - for internal use"""
+        next(token[1])
+
+    def __setitem__(self, name, emitter):
+        with self._lock:
+            super(Emitters, self).__setitem__(name, emitter)
+            self._rebuild()
+
+    def __delitem__(self, name):
+        with self._lock:
+            super(Emitters, self).__delitem__(name)
+            self._rebuild()
+
+    def clear(self):
+        with self._lock:
+            super(Emitters, self).clear()
+            self._rebuild()
+
+    def update(self, *args, **kwargs):
+        with self._lock:
+            super(Emitters, self).update(*args, **kwargs)
+            self._rebuild()
+
+    def setdefault(self, name, emitter=None):
+        with self._lock:
+            result = super(Emitters, self).setdefault(name, emitter)
+            self._rebuild()
+            return result
+
+    def pop(self, *args):
+        with self._lock:
+            result = super(Emitters, self).pop(*args)
+            self._rebuild()
+            return result
+
+    def popitem(self):
+        with self._lock:
+            result = super(Emitters, self).popitem()
+            self._rebuild()
+            return result
+
+    def replace(self, emitters, close=True, timeout=5.0):
+        """atomically replace all emitters with those in the dictionary ``emitters``.
+
+        Messages being logged when this is called finish with the old
+        emitters; later messages use the new ones. If ``close`` is True,
+        waits up to ``timeout`` seconds for those messages to finish, then
+        closes the outputs of the old emitters which aren't used by the new ones.
+        """
+        with self._lock:
+            old = self.config
+            super(Emitters, self).clear()
+            super(Emitters, self).update(emitters)
+            self._rebuild()
+            # new messages count themselves against fresh counters
+            in_flight, self._in_flight = self._in_flight, (itertools.count(), itertools.count())
+
+        if not close:
+            return
+
+        # not holding the lock, so others can use & change emitters meanwhile
+        self._drain(in_flight, timeout)
+        keep = set(id(e._output) for e in emitters.itervalues())
+        closed = set()
+        for name, emitter in old:
+            output = emitter._output
+            if id(output) in keep or id(output) in closed:
+                continue
+            closed.add(id(output))
+            try:
+                output.close()
+            except StandardError:
+                _twiggy.internal_log.warning("Error closing output of replaced emitter {0}: {1!r}", name, output)
+
+    @staticmethod
+    def _drain(in_flight, timeout):
+        """wait for messages counted by ``in_flight`` to finish - for internal use"""
+        entered, exited = in_flight
+        deadline = time.time() + timeout
+        delay = 0.0005
+        while True:
+            # peeking increments both counters, so their difference is unchanged.
+            # read exits first, so a message finishing in between isn't missed.
+            done = next(exited)
+            if next(entered) - done <= 0 or time.time() >= deadline:
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
@@ -1,6 +1,7 @@
 import copy
+import datetime
 
-from .lib.converter import ConversionTable, Converter
+from .lib.converter import ConversionTable, Converter, drop
 from .lib import iso8601time
 
 #: a default line-oriented converter
@@ -18,24 +19,126 @@ line_conversion.generic_value = str
 line_conversion.generic_item = "{0}={1}".format
 line_conversion.aggregate = ':'.join
 
+#: appended to strings shortened by `.truncate_value` and `.LineFormat`
+truncated_bytes_marker = "...[{0} bytes truncated]"
+
+#: appended to containers shortened by `.truncate_value`
+truncated_items_marker = "...[{0} items truncated]"
+
+# opening of str() for each container type
+_container_openings = {list: '[', tuple: '(', dict: '{', set: 'set([', frozenset: 'frozenset(['}
+
+# never large, so not worth converting to check
+_small_types = (int, long, float, type(None), datetime.datetime, datetime.date, datetime.time)
+
+def truncate_value(value, limit):
+    """return ``value`` if its string form is at most ``limit`` characters, else a truncated string of it.
+
+    Strings are sliced. Lists, tuples, sets & dicts are rendered one item at
+    a time, stopping once ``limit`` is reached, and the number of items left
+    out is appended. Other values are converted with :func:`str` and sliced.
+    """
+    if isinstance(value, basestring):
+        if len(value) <= limit:
+            return value
+        return value[:limit] + truncated_bytes_marker.format(len(value) - limit)
+
+    if isinstance(value, _small_types):
+        return value
+
+    opening = _container_openings.get(type(value))
+    if opening is not None:
+        if isinstance(value, dict):
+            items = ("{0!r}: {1!r}".format(k, v) for k, v in value.iteritems())
+        else:
+            items = (repr(i) for i in value)
+        pieces = []
+        length = len(opening)
+        for item in items:
+            length += len(item) + (2 if pieces else 0)
+            pieces.append(item)
+            if length > limit:
+                break
+        else:
+            return value
+        s = opening + ", ".join(pieces)
+        return s[:limit] + truncated_items_marker.format(len(value) - len(pieces) + 1)
+
+    s = str(value)
+    if len(s) <= limit:
+        return value
+    return s[:limit] + truncated_bytes_marker.format(len(s) - limit)
+
 class LineFormat(object):
-    """format a message for text-oriented output. Returns a string."""
+    """format a message for text-oriented output. Returns a string.
+
+    If ``max_value_length`` is given, longer field values are replaced with
+    truncated strings by `.truncate_value` before conversion. If
+    ``max_line_length`` is given, lines are cut off at that length (not
+    counting the marker & newline); text & tracebacks past the cut aren't
+    formatted at all.
+    """
 
-    def __init__(self, separator='|', traceback_prefix='\nTRACE ', conversion=line_conversion):
+    def __init__(self, separator='|', traceback_prefix='\nTRACE ', conversion=line_conversion,
+                 max_value_length=None, max_line_length=None):
         self.separator = separator
         self.traceback_prefix = traceback_prefix
         self.conversion = conversion
+        self.max_value_length = max_value_length
+        self.max_line_length = max_line_length
 
     # XXX test this!
     def __copy__(self):
-        return self.__class__(self.separator, self.traceback_prefix, self.conversion.copy())
+        return self.__class__(self.separator, self.traceback_prefix, self.conversion.copy(),
+                              self.max_value_length, self.max_line_length)
 
     def __call__(self, msg):
         fields = self.format_fields(msg)
+        if self.max_line_length is not None:
+            return self._format_truncated(msg, fields)
         text = self.format_text(msg)
         trace = self.format_traceback(msg)
         return "{fields}{self.separator}{text}{trace}\n".format(**locals()) # XXX gross?
 
+    def _format_truncated(self, msg, fields):
+        """format a message, cut off at `.max_line_length` - for internal use"""
+        limit = self.max_line_length
+        line = fields + self.separator
+        truncated = max(0, len(line) - limit)
+        line = line[:limit]
+
+        # work out each part's length without formatting it, and only format what fits
+        text = msg.text
+        escape = msg.suppress_newlines
+        text_length = len(text) + (text.count('\n') if escape else 0)
+        remaining = limit - len(line)
+        if text_length <= remaining:
+            line += self.format_text(msg)
+        else:
+            text = text[:remaining]
+            if escape:
+                text = text.replace('\n', '\\n')[:remaining]
+            line += text
+            truncated += text_length - len(text)
+
+        tb = msg.traceback
+        if tb is not None:
+            prefix = self.traceback_prefix
+            if tb.endswith('\n'):
+                tb = tb[:-1]
+            tb_length = len(prefix) * (tb.count('\n') + 1) - tb.count('\n') + len(tb)
+            remaining = limit - len(line)
+            if tb_length <= remaining:
+                line += self.format_traceback(msg)
+            else:
+                tb = (prefix + tb[:remaining].replace('\n', prefix))[:remaining]
+                line += tb
+                truncated += tb_length - len(tb)
+
+        if truncated:
+            line += truncated_bytes_marker.format(truncated)
+        return line + "\n"
+
     def format_text(self, msg):
         """format the text part of a message"""
         if msg.suppress_newlines:
@@ -45,17 +148,26 @@ class LineFormat(object):
 
     def format_traceback(self, msg):
         """format the traceback part of a message"""
-        if msg.traceback is not None:
-            # XXX this could be faster
-            l = msg.traceback.split('\n')
-            l = [""] + l[:-1]
-            return self.traceback_prefix.join(l)
+        tb = msg.traceback
+        if tb is not None:
+            if tb.endswith('\n'):
+                tb = tb[:-1]
+            prefix = self.traceback_prefix
+            return prefix + tb.replace('\n', prefix)
         else:
             return ""
 
+    def uses_field(self, key):
+        """does formatting use the field ``key``. See `.Output.uses_field`."""
+        return self.conversion.uses(key)
+
     def format_fields(self, msg):
         """format the fields of a message"""
-        return self.conversion.convert(msg.fields)
+        limit = self.max_value_length
+        if limit is None:
+            return self.conversion.convert(msg.fields)
+        return self.conversion.convert(dict((k, truncate_value(v, limit))
+                                            for k, v in msg.fields.iteritems()))
 
 ## some useful default objects
 
@@ -64,4 +176,4 @@ line_format = LineFormat(conversion=line_conversion)
 
 #: a format for use in the shell - no timestamp
 shell_format = copy.copy(line_format)
-shell_format.conversion.get('time').convert_item = lambda k, v: None
+shell_format.conversion.get('time').convert_item = drop
@@ -2,19 +2,21 @@
 Levels include (increasing severity): ``DEBUG``, ``INFO``, ``NOTICE``, ``WARNING``, ``ERROR``, ``CRITICAL``, ``DISABLED``
 """
 
-class LogLevel(object):
+class LogLevel(int):
     """A log level. Users should *not* create new instances.
 
-    Levels are opaque; they may be compared to each other, but nothing else.
+    Levels are ints, so they compare (to each other & to plain ints) at native
+    speed. The values match those of the stdlib's :mod:`logging`, where one exists.
     """
 
-    __slots__ = ['__name', '__value']
+    __slots__ = ['__name']
     _name2levels = {}
 
-    def __init__(self, name, value):
+    def __new__(cls, name, value):
+        self = super(LogLevel, cls).__new__(cls, value)
         self.__name = name
-        self.__value = value
-        self._name2levels[name] = self
+        cls._name2levels[name] = self
+        return self
 
     def __str__(self):
         return self.__name
@@ -22,44 +24,13 @@ class LogLevel(object):
     def __repr__(self):
         return "<LogLevel %s>"%self.__name
 
-    def __lt__(self, other):
-        if not isinstance(other, LogLevel):
-            return NotImplemented
-        else:
-            return self.__value < other.__value
+    def __format__(self, spec):
+        # format as the name, not the int
+        return format(str(self), spec)
 
-    def __le__(self, other):
-        if not isinstance(other, LogLevel):
-            return NotImplemented
-        else:
-            return self.__value <= other.__value
-
-    def __gt__(self, other):
-        if not isinstance(other, LogLevel):
-            return NotImplemented
-        else:
-            return self.__value > other.__value
-
-    def __ge__(self, other):
-        if not isinstance(other, LogLevel):
-            return NotImplemented
-        else:
-            return self.__value >= other.__value
-
-    def __eq__(self, other):
-        if not isinstance(other, LogLevel):
-            return NotImplemented
-        else:
-            return self.__value == other.__value
-
-    def __ne__(self, other):
-        if not isinstance(other, LogLevel):
-            return NotImplemented
-        else:
-            return self.__value != other.__value
-
-    def __hash__(self):
-        return hash(self.__value)
+    def __reduce__(self):
+        # levels are singletons
+        return (name2level, (self.__name,))
 
 def name2level(name):
     """return a `LogLevel` from a case-insensitve string"""
@@ -68,10 +39,10 @@ def name2level(name):
 def get_level_names():
     return LogLevel._name2levels.keys()
 
-DEBUG = LogLevel('DEBUG', 1)
-INFO = LogLevel('INFO', 2)
-NOTICE = LogLevel('NOTICE', 3)
-WARNING = LogLevel('WARNING', 4)
-ERROR = LogLevel('ERROR', 5)
-CRITICAL = LogLevel('CRITICAL', 6)
-DISABLED = LogLevel('DISABLED', 7)
+DEBUG = LogLevel('DEBUG', 10)
+INFO = LogLevel('INFO', 20)
+NOTICE = LogLevel('NOTICE', 25)
+WARNING = LogLevel('WARNING', 30)
+ERROR = LogLevel('ERROR', 40)
+CRITICAL = LogLevel('CRITICAL', 50)
+DISABLED = LogLevel('DISABLED', 60)
@@ -82,7 +82,8 @@ class ConversionTable(list):
         # XXX I have written this pattern at least 10 times
         converts = set(x.key for x in self)
         avail = set(d.iterkeys())
-        required = set(x.key for x in self if x.required)
+        # dropped items needn't be present
+        required = set(x.key for x in self if x.required and x.convert_item is not drop)
         missing = required - avail
 
         if missing:
@@ -90,7 +91,7 @@ class ConversionTable(list):
 
         l = []
         for c in self:
-            if c.key in d:
+            if c.key in d and c.convert_item is not drop:
                 item = c.convert_item(c.key, c.convert_value(d[c.key]))
                 if item is not None:
                     l.append(item)
@@ -106,6 +107,13 @@ class ConversionTable(list):
         """make an independent copy of this ConversionTable"""
         return copy.deepcopy(self)
 
+    def uses(self, key):
+        """would converting use the value of ``key``. False if all its items are `dropped <.drop>`."""
+        converters = self.get_all(key)
+        if converters:
+            return any(c.convert_item is not drop for c in converters)
+        return self.generic_item is not drop
+
     def get(self, key):
         """return the *first* converter for key"""
         for c in self:
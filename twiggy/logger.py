@@ -1,9 +1,14 @@
 from .message import Message
+import message
 from .lib import iso8601time
 import twiggy as _twiggy
 import levels
+import context
+import metrics
+import profiling
 import outputs
 import formats
+import filters
 
 import warnings
 import sys
@@ -80,9 +85,11 @@ class BaseLogger(object):
         return clone
 
     ##  Convenience
-    def trace(self, trace='error'):
+    def trace(self, trace='error', depth=None):
         """convenience method to enable traceback logging"""
-        return self.options(trace=trace)
+        if depth is None:
+            return self.options(trace=trace)
+        return self.options(trace=trace, trace_depth=depth)
 
     def name(self, name):
         """convenvience method to bind ``name`` field"""
@@ -148,10 +155,62 @@ class InternalLogger(BaseLogger):
             print>>sys.stderr, "Offending message:", repr(msg)
             traceback.print_exc(file = sys.stderr)
 
+# the level methods of `.BaseLogger`
+_level_methods = (('debug', levels.DEBUG), ('info', levels.INFO), ('notice', levels.NOTICE),
+                  ('warning', levels.WARNING), ('error', levels.ERROR), ('critical', levels.CRITICAL))
+
+# return values of level methods, where not None
+_level_method_results = {'notice': True}
+
+def _disabled_method(name, level):
+    """return a stand-in for the level method ``name``, for when ``level`` is disabled - for internal use"""
+    result = _level_method_results.get(name)
+    def disabled(self, format_spec = '', *args, **kwargs):
+        # only emit to count the rejection
+        if metrics.enabled: self._emit(level, format_spec, args, kwargs)
+        return result
+    disabled.__name__ = name
+    disabled.__doc__ = getattr(BaseLogger, name).__doc__
+    return disabled
+
+# shared by all specialized classes, see `._specialized_class`
+_disabled_methods = dict((name, _disabled_method(name, level)) for name, level in _level_methods)
+
+def _specialized_class(cls, emitters, min_level):
+    """return a subclass of ``cls`` whose level methods are replaced by
+    `._disabled_methods` for levels below ``min_level`` or all of ``emitters``.
+
+    It's updated whenever ``emitters`` change - for internal use.
+    """
+    spec = type(cls.__name__, (cls,), {'__slots__': (), '__module__': cls.__module__,
+                                       '_unspecialized': cls})
+    threshold = [None]
+
+    def respecialize():
+        new = max(min_level, emitters.min_level)
+        if new == threshold[0]: return
+        threshold[0] = new
+        for name, level in _level_methods:
+            if level < new:
+                setattr(spec, name, _disabled_methods[name])
+            elif name in spec.__dict__:
+                delattr(spec, name)
+
+    respecialize()
+    emitters._listeners.append(respecialize)
+    return spec
+
+#: maximum number of format_specs to cache `.Logger.filter` results for
+FILTER_CACHE_SIZE = 1000
+
+def _no_filter(format_spec):
+    """the default `.Logger.filter`, which passes everything"""
+    return True
+
 class Logger(BaseLogger):
     """Logger for end-users"""
 
-    __slots__ = ['_emitters', 'filter']
+    __slots__ = ['_emitters', '_filter', '_filter_cache', '_min_level']
 
     def _feature_noop(self, *args, **kwargs):
         return self._clone()
@@ -164,6 +223,7 @@ class Logger(BaseLogger):
         :arg string name: the name to add it under. If None, use the function's name.
         """
         warnings.warn("Use of features is currently discouraged, pending refactoring", RuntimeWarning)
+        cls = getattr(cls, '_unspecialized', cls)
         name = name if name is not None else func.__name__
         setattr(cls, name, func)
 
@@ -176,6 +236,7 @@ class Logger(BaseLogger):
         :arg string name: the name of the feature to disable.
         """
         warnings.warn("Use of features is currently discouraged, pending refactoring", RuntimeWarning)
+        cls = getattr(cls, '_unspecialized', cls)
         # get func directly from class dict - we don't want an unbound method.
         setattr(cls, name, cls.__dict__['_feature_noop'])
 
@@ -186,23 +247,78 @@ class Logger(BaseLogger):
         :arg string name: the name of the feature to remove
         """
         warnings.warn("Use of features is currently discouraged, pending refactoring", RuntimeWarning)
+        cls = getattr(cls, '_unspecialized', cls)
         delattr(cls, name)
 
     def __init__(self, fields = None, options = None, emitters = None,
                  min_level = None, filter = None):
+        #: an `.Emitters` dictionary
+        if emitters is None:
+            emitters = filters.Emitters()
+        elif not isinstance(emitters, filters.Emitters):
+            emitters = filters.Emitters(emitters)
+        self._emitters = emitters
         super(Logger, self).__init__(fields, options, min_level)
-        #: a dict of emitters
-        self._emitters = emitters if emitters is not None else {}
-        self.filter = filter if filter is not None else lambda format_spec: True
+        self.filter = filter if filter is not None else _no_filter
+
+    @property
+    def min_level(self):
+        """the minimum level to emit at.
+
+        Level methods for levels below this, or below every emitter's
+        min_level, are replaced by stand-ins which return immediately.
+        They're restored when levels are lowered.
+        """
+        return self._min_level
+
+    @min_level.setter
+    def min_level(self, level):
+        self._min_level = level
+        cls = getattr(type(self), '_unspecialized', type(self))
+        key = (cls, level)
+        classes = self._emitters._logger_classes
+        try:
+            spec = classes[key]
+        except KeyError:
+            with self._emitters._lock:
+                spec = classes.get(key)
+                if spec is None:
+                    spec = classes[key] = _specialized_class(cls, self._emitters, level)
+        self.__class__ = spec
 
     def _clone(self):
         """return a new Logger instance with copied attributes
 
         Probably only for internal use.
         """
-        return self.__class__(fields = self._fields, options = self._options,
-                              emitters = self._emitters, min_level = self.min_level,
-                              filter = self.filter)
+        clone = self.__class__(fields = self._fields, options = self._options,
+                               emitters = self._emitters, min_level = self.min_level,
+                               filter = self._filter)
+        # same filter, so share its results
+        clone._filter_cache = self._filter_cache
+        return clone
+
+    @property
+    def filter(self):
+        """function of ``format_spec``, returning whether to emit.
+
+        Results are cached per ``format_spec``, so it should only depend on
+        its argument. Assigning a new filter clears the cache.
+        """
+        return self._filter
+
+    @filter.setter
+    def filter(self, f):
+        self._filter = f
+        self._filter_cache = None if f is _no_filter else {}
+
+    def template(self, level, format_spec):
+        """return a `.MessageTemplate`, which emits ``format_spec`` at ``level`` when called.
+
+        The logger's fields, options, `min_level <.BaseLogger.min_level>` and `.filter`
+        are resolved once, when the template is created.
+        """
+        return MessageTemplate(self, level, format_spec)
 
     @emit.info
     def struct(self, **kwargs):
@@ -225,44 +341,216 @@ class Logger(BaseLogger):
     def _emit(self, level, format_spec, args, kwargs):
         """does the work of emitting - for internal use"""
 
+        count = metrics.enabled
+        if count: metrics.logger.incr('considered')
+
         # XXX should these traps be collapsed?
-        if level < self.min_level: return
+        if level < self._min_level:
+            if count: metrics.logger.incr('rejected_level')
+            return
 
+        if self._filter_cache is not None and not self._passes_filter(format_spec):
+            if count: metrics.logger.incr('rejected_filter')
+            return
+
+        self._emit_message(level, format_spec, self._options, args, kwargs)
+
+    def _passes_filter(self, format_spec):
+        """run `.filter` on ``format_spec``, using the cache - for internal use"""
+        profile = profiling.enabled
+        cache = self._filter_cache
         try:
-            if not self.filter(format_spec): return
+            if profile: start = profiling.timer()
+            try:
+                passed = cache[format_spec]
+            except KeyError:
+                passed = self._filter(format_spec)
+                if len(cache) >= FILTER_CACHE_SIZE:
+                    cache.clear()
+                cache[format_spec] = passed
+            except TypeError:
+                # unhashable format_spec
+                passed = self._filter(format_spec)
+            if profile: profiling.logger.add('logger_filter', profiling.timer() - start)
         except StandardError:
-            _twiggy.internal_log.info("Error in Logger filtering with {0} on {1}", repr(self.filter), format_spec)
+            if metrics.enabled: metrics.logger.incr('internal_errors')
+            _twiggy.internal_log.info("Error in Logger filtering with {0} on {1}", repr(self._filter), format_spec)
             # just continue emitting in face of filter error
+            passed = True
+        return passed
+
+    def _emit_message(self, level, format_spec, options, args, kwargs):
+        """create & output a message, after the logger's own checks - for internal use"""
+        count = metrics.enabled
+        profile = profiling.enabled
+        emitters = self._emitters
+        token = emitters._enter()
+        try:
+            # emitters may be reconfigured concurrently; use a consistent snapshot, see `.Emitters`
+            config = emitters.config
+            potential_emitters = [(name, emitter) for name, emitter in config
+                                  if level >= emitter.min_level]
+
+            if count and len(potential_emitters) < len(config):
+                for name, emitter in config:
+                    if level < emitter.min_level:
+                        emitter.metrics.incr('rejected_level')
+
+            if not potential_emitters: return
+
+            ambient = context.get_fields()
+            if ambient:
+                fields = ambient.copy()
+                fields.update(self._fields)
+            else:
+                fields = self._fields.copy()
+
+            # run pre-filters, so no message is created if no emitter wants it
+            accepted = []
+            for name, emitter in potential_emitters:
+                pre_filter = emitter.pre_filter
+                if pre_filter is not None:
+                    try:
+                        if profile: start = profiling.timer()
+                        include = pre_filter(level, fields)
+                        if profile: emitter.timings.add('pre_filter', profiling.timer() - start)
+                    except StandardError:
+                        if count: metrics.logger.incr('internal_errors')
+                        _twiggy.internal_log.info("Error pre-filtering with emitter {}. Pre-filter: {} Fields: {!r}",
+                                                  name, repr(pre_filter), fields)
+                        include = True # output anyway if error
+                    if not include:
+                        if count: emitter.metrics.incr('rejected_filter')
+                        continue
+                accepted.append((name, emitter))
+
+            if not accepted: return
+
+            # only evaluate callable fields which some emitter will use
+            for key, value in fields.items():
+                if callable(value):
+                    for name, emitter in accepted:
+                        if emitter.uses_field(key): break
+                    else:
+                        del fields[key]
+
+            try:
+                if profile: start = profiling.timer()
+                msg = Message(level, format_spec, fields, options, args, kwargs)
+                if profile: profiling.logger.add('message', profiling.timer() - start)
+            except StandardError:
+                if count: metrics.logger.incr('internal_errors')
+                # XXX use .fields() instead?
+                _twiggy.internal_log.info("Error formatting message level: {0!r}, format: {1!r}, fields: {2!r}, "\
+                                          "options: {3!r}, args: {4!r}, kwargs: {5!r}",
+                                          level, format_spec, self._fields, options, args, kwargs)
+                return
+
+            outputs = set()
+            # config is sorted by name, to make things deterministic (for tests, mainly)
+            for name, emitter in accepted:
+                try:
+                    if profile: start = profiling.timer()
+                    include = emitter.filter(msg)
+                    if profile: emitter.timings.add('filter', profiling.timer() - start)
+                except StandardError:
+                    if count: metrics.logger.incr('internal_errors')
+                    _twiggy.internal_log.info("Error filtering with emitter {}. Filter: {} Message: {!r}",
+                                              name, repr(emitter.filter), msg)
+                    include = True # output anyway if error
+
+                if include:
+                    outputs.add(emitter._output)
+                    if count: emitter.metrics.incr(('emitted', str(level)))
+                elif count:
+                    emitter.metrics.incr('rejected_filter')
+
+            if count and outputs: metrics.logger.incr(('emitted', str(level)))
+
+            timed = profiling.latency_enabled
+            for o in outputs:
+                try:
+                    if timed: start = profiling.timer()
+                    o.output(msg)
+                    if timed: o.latency[level].record(profiling.timer() - start)
+                except StandardError:
+                    if count: metrics.logger.incr('internal_errors')
+                    _twiggy.internal_log.warning("Error outputting with {0!r}. Message: {1!r}", o, msg)
+        finally:
+            emitters._exit(token)
+
+    _untimed_emit = _emit
+
+    def _timed_emit(self, level, format_spec, args, kwargs):
+        """`._emit`, recording latency - for internal use. See `.profiling.record_latency`"""
+        start = profiling.timer()
+        try:
+            self._untimed_emit(level, format_spec, args, kwargs)
+        finally:
+            profiling.calls[level].record(profiling.timer() - start)
+
+class MessageTemplate(object):
+    """A pre-bound message for hot call sites. Create with `.Logger.template`.
 
-        # XXX should we trap here too b/c of "Dictionary changed size during iteration" (or other rare errors?)
-        potential_emitters = [(name, emitter) for name, emitter in self._emitters.iteritems()
-                              if level >= emitter.min_level]
+    Call with the substitution arguments for `.format_spec`, like `.Logger.info`, etc.::
 
-        if not potential_emitters: return
+        query = log.name('db').template(levels.INFO, "query {table} took {ms}ms")
+        query(table='users', ms=42)
+
+    The level check against the logger, its `.Logger.filter` and the format spec style
+    are resolved when the template is created, and later changes to the logger aren't seen.
+    Changes to `.emitters` still are. If `.format_spec` has no substitutions, the text
+    is formatted once, and calls without arguments skip formatting.
+    """
+
+    __slots__ = ['_logger', 'level', 'format_spec', '_options', '_literal_options', '_text', '_rejected']
+
+    def __init__(self, logger, level, format_spec):
+        """
+        :arg Logger logger: the logger to emit with
+        :arg LogLevel level: the level to emit at
+        :arg string format_spec: the message template, matching the logger's ``style`` option
+        """
+        self._logger = logger = logger._clone()
+        self.level = level
+        self.format_spec = format_spec
+
+        options = self._options = logger._options
+        options['style'] = style = message._resolve_style(options['style'])
+
+        if level < logger.min_level:
+            self._rejected = 'rejected_level'
+        elif logger._filter_cache is not None and not logger._passes_filter(format_spec):
+            self._rejected = 'rejected_filter'
+        else:
+            self._rejected = None
 
         try:
-            msg = Message(level, format_spec, self._fields.copy(), self._options.copy(), args, kwargs)
+            self._text = message._substitute(style, format_spec, (), {})
         except StandardError:
-            # XXX use .fields() instead?
-            _twiggy.internal_log.info("Error formatting message level: {0!r}, format: {1!r}, fields: {2!r}, "\
-                                      "options: {3!r}, args: {4!r}, kwargs: {5!r}",
-                                      level, format_spec, self._fields, self._options, args, kwargs)
+            # needs arguments
+            self._text = None
+        self._literal_options = dict(options, style='_literal')
+
+    def __call__(self, *args, **kwargs):
+        """emit the message, substituting ``args`` and ``kwargs`` into `.format_spec`"""
+        rejected = self._rejected
+        if metrics.enabled:
+            metrics.logger.incr('considered')
+            if rejected is not None: metrics.logger.incr(rejected)
+        if rejected is not None:
             return
 
-        outputs = set()
-        # sort to make things deterministic (for tests, mainly)
-        for name, emitter in sorted(potential_emitters):
-            try:
-                include = emitter.filter(msg)
-            except StandardError:
-                _twiggy.internal_log.info("Error filtering with emitter {}. Filter: {} Message: {!r}",
-                                          name, repr(emitter.filter), msg)
-                include = True # output anyway if error
-            
-            if include: outputs.add(emitter._output)
+        if args or kwargs or self._text is None:
+            format_spec, options = self.format_spec, self._options
+        else:
+            format_spec, options = self._text, self._literal_options
 
-        for o in outputs:
+        if profiling.latency_enabled:
+            start = profiling.timer()
             try:
-                o.output(msg)
-            except StandardError:
-                _twiggy.internal_log.warning("Error outputting with {0!r}. Message: {1!r}", o, msg)
+                self._logger._emit_message(self.level, format_spec, options, args, kwargs)
+            finally:
+                profiling.calls[self.level].record(profiling.timer() - start)
+        else:
+            self._logger._emit_message(self.level, format_spec, options, args, kwargs)
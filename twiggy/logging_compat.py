@@ -13,11 +13,15 @@ hijack interface:
 
 logging bridge:
   LoggingBridgeOutput - an output that bridges log messages to stdlib's logging.  
+  TwiggyHandler - a handler that bridges stdlib's logging to twiggy.
+
+Don't use both directions at once for the same loggers - messages will loop.
 """
 __all__ = ["basicConfig", "hijack", "restore",
-           "getLogger", "root", "LoggingBridgeOutput"]
+           "getLogger", "root", "LoggingBridgeOutput", "TwiggyHandler"]
 
 import sys
+import os
 import logging as orig_logging
 from threading import Lock
 
@@ -78,10 +82,12 @@ class FakeLogger(object):
         return self._logger.min_level
 
     def getEffectiveLevel(self):
-        return self.level
+        """the lowest level that would be emitted, by this logger and any of its emitters"""
+        return max(self._logger.min_level, self._logger._emitters.min_level)
 
     def isEnabledFor(self, level):
-        return level >= self.level
+        logger = self._logger
+        return level >= logger.min_level and level >= logger._emitters.min_level
 
     def log(self, level, format_spec, *args, **kwargs):
         """
@@ -100,18 +106,101 @@ root = FakeLogger(log.options(style="percent"))
 _logger_cache = {} # name to logger
 _logger_cache_lock = Lock()
 def getLogger(name=None):
-    if name is not None:
-        with _logger_cache_lock:
-            if name not in _logger_cache:
-                _logger_cache[name] = FakeLogger(log.name(name).options(style="percent"))
+    if name is None:
+        return root
+    # dict lookups are atomic; only lock to create
+    try:
+        return _logger_cache[name]
+    except KeyError:
+        pass
+    with _logger_cache_lock:
+        if name not in _logger_cache:
+            _logger_cache[name] = FakeLogger(log.name(name).options(style="percent"))
         return _logger_cache[name]
-    return root
+
+# twiggy levels which stdlib's levels are rounded down to
+_twiggy_levels = (DEBUG, INFO, NOTICE, WARNING, ERROR, CRITICAL)
+
+def _make_level_table():
+    """return a list, indexed by stdlib level number, of twiggy levels"""
+    table = []
+    for n in xrange(CRITICAL + 1):
+        below = [l for l in _twiggy_levels if l <= n]
+        table.append(below[-1] if below else DEBUG)
+    return table
+
+class TwiggyHandler(orig_logging.Handler):
+    """
+    A handler for stdlib's logging that emits records to twiggy.
+
+    usage:
+      logging.getLogger().addHandler(TwiggyHandler())
+
+    translates logging's:
+      logging.getLogger("spam").info("eggs %s", 42)
+    into twiggy's:
+      log.name("spam").options(style="percent").info("eggs %s", 42)
+
+    ``record.msg`` and ``record.args`` are passed along unformatted, so
+    the message is only formatted if a twiggy emitter wants it. Levels
+    are rounded down to the nearest twiggy level. With the ``caller``
+    option, caller fields are taken from the record.
+
+    The handler has no lock of its own; twiggy outputs do their own locking.
+
+    :arg logger: the twiggy `.Logger` to emit to. Defaults to `twiggy.log`.
+    """
+
+    _level_table = _make_level_table()
+
+    def __init__(self, logger=None, level=orig_logging.NOTSET):
+        orig_logging.Handler.__init__(self, level)
+        self._logger = logger if logger is not None else log
+        self._loggers = {} # record name to bound twiggy logger
+
+    def createLock(self):
+        # twiggy outputs do their own locking
+        self.lock = None
+
+    def _twiggy_logger(self, name):
+        """return the twiggy logger for ``name``, cached - for internal use"""
+        try:
+            return self._loggers[name]
+        except KeyError:
+            logger = self._loggers[name] = self._logger.name(name).options(style="percent")
+            return logger
+
+    def emit(self, record):
+        try:
+            logger = self._twiggy_logger(record.name)
+            levelno = record.levelno
+            table = self._level_table
+            level = table[levelno] if 0 <= levelno < len(table) else (CRITICAL if levelno > 0 else DEBUG)
+            if record.exc_info:
+                logger = logger.trace(record.exc_info)
+            if logger._options.get('caller'):
+                # the stack is logging's internals; the record knows the real caller
+                logger = logger.fields(file=os.path.basename(record.pathname), line=record.lineno,
+                                       func=record.funcName).options(caller=False)
+
+            args = record.args
+            if not args:
+                # logging doesn't format messages without args
+                logger._emit(level, "%s", (record.msg,), {})
+            elif isinstance(args, dict):
+                logger._emit(level, record.msg, (), args)
+            else:
+                logger._emit(level, record.msg, args, {})
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
 
 logging_bridge_converter = ConversionTable([('time', lambda x:x, drop),
                                             ('name', lambda x:x, drop),
                                             ('level', lambda x:x, drop)])
-logging_bridge_converter.genericValue = str
-logging_bridge_converter.genericItem = "{0}={1}".format
+logging_bridge_converter.generic_value = str
+logging_bridge_converter.generic_item = "{0}={1}".format
 logging_bridge_converter.aggregate = ':'.join
 
 class LoggingBridgeFormat(LineFormat):
@@ -124,6 +213,9 @@ class LoggingBridgeFormat(LineFormat):
         super(LoggingBridgeFormat, self).__init__(conversion=logging_bridge_converter, 
                                                   *args, **kwargs)
     
+    def uses_field(self, key):
+        return key in ('name', 'level') or super(LoggingBridgeFormat, self).uses_field(key)
+
     def __call__(self, msg):
         return (super(LoggingBridgeFormat, self).__call__(msg),
                 msg.level,
@@ -142,15 +234,56 @@ class LoggingBridgeOutput(Output):
     We translate a logging level to a twiggy level by name or 
     by a fallback map. and get logging's logger by the name
     of twiggy's logger.
+
+    Messages for loggers which aren't enabled for their level are skipped
+    before formatting. By default, records are formatted only by logging:
+    the record's message is the message text, structured fields are passed
+    as ``extra`` and the traceback as ``exc_text``. If ``format`` is given,
+    it should return a ``(text, level, name)`` tuple like `LoggingBridgeFormat`,
+    and ``text`` is logged instead.
     """
 
     # for levels in twiggy that aren't in stdlib's logging    
     FALLBACK_MAP = { NOTICE : orig_logging.WARNING,
                      DISABLED : orig_logging.NOTSET }
 
-    def __init__(self, *args, **kwargs):
-        super(LoggingBridgeOutput, self).__init__(format=LoggingBridgeFormat(),
-                                                  *args, **kwargs)
+    # logging has its own locks
+    use_locks = False
+
+    # fields that are part of the LogRecord, or can't be passed as extra
+    _reserved_fields = frozenset(orig_logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | \
+                       frozenset(['message', 'asctime', 'time', 'level', 'file', 'line', 'func'])
+
+    def __init__(self, format=None, close_atexit=True):
+        super(LoggingBridgeOutput, self).__init__(format, close_atexit)
+        self._structured = format is None
+        self._loggers = {} # name to logging's logger
+        self._levels = {} # twiggy level to logging level
+        self.__output = self.output
+        self.output = self.__enabled_output
+
+    def _logging_logger(self, name):
+        """return logging's logger for ``name``, cached - for internal use"""
+        try:
+            return self._loggers[name]
+        except KeyError:
+            logger = self._loggers[name] = orig_logging.getLogger(name)
+            return logger
+
+    def _logging_level(self, level):
+        """return logging's level for a twiggy level, cached - for internal use"""
+        try:
+            return self._levels[level]
+        except KeyError:
+            logging_level = getattr(orig_logging, str(level), None)
+            if logging_level is None:
+                logging_level = self.FALLBACK_MAP[level]
+            self._levels[level] = logging_level
+            return logging_level
+
+    def __enabled_output(self, msg):
+        if self._logging_logger(msg.name).isEnabledFor(self._logging_level(msg.level)):
+            self.__output(msg)
 
     def _open(self):
         pass
@@ -158,9 +291,21 @@ class LoggingBridgeOutput(Output):
     def _close(self):
         pass
     
-    def _write(self, args):
-        text, level, name = args
-        logging_level = getattr(orig_logging, str(level), None)
-        if logging_level is None:
-            logging_level = self.FALLBACK_MAP[level]
-        orig_logging.getLogger(name).log(logging_level, text)
+    def _write(self, x):
+        if not self._structured:
+            text, level, name = x
+            self._logging_logger(name).log(self._logging_level(level), text)
+            return
+
+        msg = x
+        fields = msg.fields
+        logger = self._logging_logger(msg.name)
+        reserved = self._reserved_fields
+        extra = dict((k, v) for k, v in fields.iteritems() if k not in reserved)
+        record = logger.makeRecord(logger.name, self._logging_level(msg.level),
+                                   fields.get('file', '(unknown file)'), fields.get('line', 0),
+                                   msg.text, (), None, fields.get('func'), extra)
+        traceback = msg.traceback
+        if traceback:
+            record.exc_text = traceback.rstrip('\n')
+        logger.handle(record)
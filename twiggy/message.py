@@ -1,17 +1,280 @@
-__all__ = ['Message']
+__all__ = ['Message', 'FieldsView']
 
 import sys
+import os
 import traceback
+import linecache
+from collections import Mapping
 from string import Template
 
+import profiling
+
+#: maximum number of distinct stacks to keep formatted text for
+TRACE_CACHE_SIZE = 1000
+
+_trace_cache = {}
+
+def _format_stack(stack):
+    """format a tuple of ``(filename, lineno, funcname)`` frame summaries, outermost first.
+
+    Results are cached, so repeated stacks are only formatted once.
+    """
+    try:
+        return _trace_cache[stack]
+    except KeyError:
+        pass
+
+    entries = []
+    for filename, lineno, name in stack:
+        linecache.checkcache(filename)
+        line = linecache.getline(filename, lineno)
+        entries.append((filename, lineno, name, line.strip() if line else None))
+    text = "".join(traceback.format_list(entries))
+
+    if len(_trace_cache) >= TRACE_CACHE_SIZE:
+        _trace_cache.clear()
+    _trace_cache[stack] = text
+    return text
+
+# frames from files in this directory are twiggy internals, and skipped when capturing stacks & callers.
+# compare with the path code objects record, which is relative if twiggy was imported by a relative path.
+_twiggy_dir = os.path.dirname(sys._getframe().f_code.co_filename) or os.path.dirname(os.path.abspath(__file__))
+_twiggy_dir += os.sep
+
+def _skip_twiggy_frames(f):
+    """return the first frame at or above ``f`` that's outside twiggy"""
+    while f.f_back is not None and f.f_code.co_filename.startswith(_twiggy_dir):
+        f = f.f_back
+    return f
+
+def _capture_stack(depth=None):
+    """return a tuple of ``(filename, lineno, funcname)`` for the caller's stack, outermost first.
+
+    Frames inside twiggy are skipped. Only the innermost ``depth`` frames are kept.
+    """
+    f = _skip_twiggy_frames(sys._getframe(1))
+
+    stack = []
+    while f is not None and (depth is None or len(stack) < depth):
+        code = f.f_code
+        stack.append((code.co_filename, f.f_lineno, code.co_name))
+        f = f.f_back
+    stack.reverse()
+    return tuple(stack)
+
+#: maximum number of call sites to keep caller fields for
+CALLER_CACHE_SIZE = 1000
+
+_caller_cache = {}
+
+def _caller_fields():
+    """return a ``(file, line, func)`` tuple for the first frame outside twiggy.
+
+    Results are cached per code object & line number.
+    """
+    # Message.__init__ <- Logger._emit_message <- Logger._emit <- Logger.debug, etc. <- caller
+    try:
+        f = sys._getframe(4)
+    except ValueError:
+        f = None
+    if f is not None and f.f_code.co_filename.startswith(_twiggy_dir) and \
+       f.f_back is not None and not f.f_back.f_code.co_filename.startswith(_twiggy_dir):
+        f = f.f_back
+    else:
+        # called some other way (logging_compat, emit decorators, etc.)
+        f = _skip_twiggy_frames(sys._getframe(1))
+
+    code = f.f_code
+    key = (code, f.f_lineno)
+    try:
+        return _caller_cache[key]
+    except KeyError:
+        pass
+
+    if len(_caller_cache) >= CALLER_CACHE_SIZE:
+        _caller_cache.clear()
+    result = _caller_cache[key] = (intern(os.path.basename(code.co_filename)), f.f_lineno, code.co_name)
+    return result
+
+def _extract_tb(tb):
+    """return a tuple of ``(filename, lineno, funcname)`` for a traceback, outermost first"""
+    stack = []
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        stack.append((code.co_filename, tb.tb_lineno, code.co_name))
+        tb = tb.tb_next
+    return tuple(stack)
+
+def _format_exception(etype, value, stack):
+    """like :func:`traceback.format_exception`, but takes a stack from `._extract_tb`,
+    returns a string & uses the stack cache"""
+    parts = []
+    if stack:
+        parts.append("Traceback (most recent call last):\n")
+        parts.append(_format_stack(stack))
+    parts.extend(traceback.format_exception_only(etype, value))
+    return "".join(parts)
+
+#: maximum number of distinct sets of field names to keep
+SHAPE_CACHE_SIZE = 1000
+
+_shapes = {}
+
+def _shape(keys):
+    """return a shared ``(keys, index)`` pair for a tuple of field names.
+
+    ``index`` maps each name to its position in ``keys``. Names are interned,
+    and messages with the same names share one pair.
+    """
+    try:
+        return _shapes[keys]
+    except KeyError:
+        pass
+
+    if len(_shapes) >= SHAPE_CACHE_SIZE:
+        _shapes.clear()
+    interned = tuple(intern(k) if type(k) is str else k for k in keys)
+    shape = _shapes[keys] = (interned, dict((k, i) for i, k in enumerate(interned)))
+    return shape
+
+class FieldsView(object):
+    """A read-only mapping of a `.Message`'s fields.
+
+    Field names are shared between messages with the same set of fields;
+    each message only stores a tuple of values.
+    """
+
+    __slots__ = ['_keys', '_index', '_values']
+
+    def __init__(self, keys, values):
+        """
+        :arg tuple keys: field names
+        :arg tuple values: field values, in the same order as ``keys``
+        """
+        self._keys, self._index = _shape(keys)
+        self._values = values
+
+    @classmethod
+    def from_dict(cls, d):
+        """return a view of a copy of the dictionary ``d``"""
+        # keys & values are in corresponding order for an unmodified dict
+        return cls(tuple(d), tuple(d.itervalues()))
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key, default=None):
+        try:
+            return self._values[self._index[key]]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._keys, self._values)
+
+    def iterkeys(self):
+        return iter(self._keys)
+
+    def itervalues(self):
+        return iter(self._values)
+
+    def iteritems(self):
+        return iter(zip(self._keys, self._values))
+
+    def __eq__(self, other):
+        if isinstance(other, FieldsView):
+            other = other.copy()
+        elif not isinstance(other, Mapping):
+            return NotImplemented
+        return self.copy() == dict(other)
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = None
+
+    def copy(self):
+        """return a new dictionary with the same fields"""
+        return dict(zip(self._keys, self._values))
+
+    def __repr__(self):
+        return "<FieldsView {0!r}>".format(self.copy())
+
+    def __reduce__(self):
+        return (FieldsView, (self._keys, self._values))
+
+# a Mapping, without the __dict__ that subclassing it would add
+Mapping.register(FieldsView)
+
+_style_aliases = {'braces':'braces', 'dollar':'dollar',
+        'percent':'percent', '{}':'braces', '$':'dollar',
+        '%':'percent',
+        # format_spec is the finished text - for internal use by `.MessageTemplate`
+        '_literal':'_literal'}
+
+def _resolve_style(style):
+    """return the canonical name for a format spec ``style``"""
+    try:
+        return _style_aliases[style]
+    except KeyError:
+        raise ValueError("Bad format spec style {0!r}".format(style))
+
+def _substitute(style, format_spec, args, kwargs):
+    """substitute ``args`` and ``kwargs`` into ``format_spec``, for a canonical ``style``"""
+    if style == 'braces':
+        return format_spec.format(*args, **kwargs)
+    elif style == 'percent':
+        # a % style format
+        if args and kwargs:
+            raise ValueError("can't have both args & kwargs with % style format specs")
+        else:
+            return format_spec % (args or kwargs)
+    elif style == 'dollar':
+        if args:
+            raise ValueError("can't use args with $ style format specs")
+        return Template(format_spec).substitute(kwargs)
+    else:
+        assert False, "impossible style"
+
+def _unpickle_message(keys, values, suppress_newlines, traceback, text):
+    """recreate a `.Message` pickled by `.Message.__reduce__` - for internal use"""
+    msg = Message.__new__(Message)
+    msg.fields = FieldsView(keys, values)
+    msg.suppress_newlines = suppress_newlines
+    msg._traceback = traceback
+    msg._exc_info = msg._stack = None
+    msg.text = text
+    return msg
+
 class Message(object):
-    """A log message.  All attributes are read-only."""
+    """A log message.  All attributes are read-only.
 
-    __slots__ = ['fields', 'suppress_newlines', 'traceback', 'text']
+    `.fields` is a read-only `.FieldsView`.
+    """
+
+    __slots__ = ['fields', 'suppress_newlines', '_traceback', '_exc_info', '_stack', 'text']
 
     #: default option values. Don't change these!
     _default_options = {'suppress_newlines' : True,
                         'trace' : None,
+                        'trace_depth' : None,
+                        'caller' : False,
                         'style': 'braces'}
 
     # XXX I need a __repr__!
@@ -27,44 +290,39 @@ class Message(object):
         :arg dict options: a dictionary of :ref:`options <message-options>` to control message creation.
         """
 
-        self.fields = fields
         self.suppress_newlines = options['suppress_newlines']
-        self.fields['level'] = level
+        fields['level'] = level
+
+        if options.get('caller'):
+            fields['file'], fields['line'], fields['func'] = _caller_fields()
 
-        ## format traceback
-        # XXX this needs some cleanup/branch consolidation
+        ## capture traceback. It's formatted lazily, see `traceback`.
+        ## Only a summary of the frames is kept, so their locals aren't kept alive.
+        self._traceback = None
+        self._exc_info = None
+        self._stack = None
         trace = options['trace']
         if isinstance(trace, tuple) and len(trace) == 3:
-            self.traceback = "\n".join(traceback.format_exception(*trace))
+            self._exc_info = (trace[0], trace[1], _extract_tb(trace[2]))
         elif trace == "error":
-            tb = sys.exc_info()
-            if tb[0] is None:
-                self.traceback = None
-            else:
-                self.traceback = traceback.format_exc()
+            etype, value, tb = sys.exc_info()
+            if etype is not None:
+                self._exc_info = (etype, value, _extract_tb(tb))
+            del tb
         elif trace == "always":
-            raise NotImplementedError
-            # XXX build a traceback using getframe
-            # XXX maybe an option to just provide current frame info instead of full stack?
+            self._stack = _capture_stack(options.get('trace_depth'))
         elif trace is not None:
             raise ValueError("bad trace {0!r}".format(trace))
-        else:
-            self.traceback = None
 
-        style = options['style']
-
-        style_aliases = {'braces':'braces', 'dollar':'dollar',
-                'percent':'percent', '{}':'braces', '$':'dollar',
-                '%':'percent'}
-        try:
-            style = style_aliases[style]
-        except KeyError:
-            raise ValueError("Bad format spec style {0!r}".format(style))
+        style = _resolve_style(options['style'])
 
         ## Populate `text` by calling callables in `fields`, `args` and `kwargs`,
         ## and substituting into `format_spec`.
 
         ## call any callables
+        profile = profiling.enabled
+        if profile: start = profiling.timer()
+
         for k, v in fields.iteritems():
             if callable(v):
                 fields[k] = v()
@@ -75,27 +333,35 @@ class Message(object):
 
         args = tuple(v() if callable(v) else v for v in args)
 
+        if profile: profiling.logger.add('callables', profiling.timer() - start)
+
+        self.fields = FieldsView.from_dict(fields)
+
         ## substitute
-        if format_spec == '':
-            self.text = ''
+        if format_spec == '' or style == '_literal':
+            self.text = format_spec
             return
 
-        if style == 'braces':
-            s = format_spec.format(*args, **kwargs)
-        elif style == 'percent':
-            # a % style format
-            if args and kwargs:
-                raise ValueError("can't have both args & kwargs with % style format specs")
-            else:
-                s = format_spec % (args or kwargs)
-        elif style == 'dollar':
-            if args:
-                raise ValueError("can't use args with $ style format specs")
-            s = Template(format_spec).substitute(kwargs)
-        else:
-            assert False, "impossible style"
+        self.text = _substitute(style, format_spec, args, kwargs)
+
+    @property
+    def traceback(self):
+        """the formatted traceback, or None. Formatted on first access."""
+        exc_info = self._exc_info
+        if exc_info is not None:
+            self._traceback = _format_exception(*exc_info)
+            self._exc_info = None
+        stack = self._stack
+        if stack is not None:
+            self._traceback = "Stack (most recent call last):\n" + _format_stack(stack)
+            self._stack = None
+        return self._traceback
 
-        self.text = s
+    def __reduce__(self):
+        # tracebacks can't be pickled, so format before sending to other processes
+        fields = self.fields
+        return (_unpickle_message, (fields._keys, fields._values, self.suppress_newlines,
+                                    self.traceback, self.text))
 
     @property
     def name(self):
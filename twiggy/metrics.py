@@ -0,0 +1,190 @@
+"""Runtime metrics for the logging pipeline.
+
+Metrics are off by default. Set ``enabled`` to True to start counting::
+
+    twiggy.metrics.enabled = True
+
+The following are counted:
+
+:logger: messages considered, rejected by level or by `.Logger.filter`,
+    emitted per level, and internal errors (bad messages, filters or outputs)
+:emitters: messages rejected by level or by filter (including pre-filters), and emitted per level
+:outputs: messages and bytes written. Outputs using :term:`asynchronous logging`
+    count messages as they're queued, can't count bytes, and additionally report
+    the current queue depth and dropped messages.
+
+Counters are accumulated per-thread and only summed when a `.snapshot` is taken.
+"""
+
+__all__ = ['enabled', 'Counters', 'logger', 'snapshot', 'format_prometheus', 'dump', 'dump_periodically']
+
+import os
+import threading
+import time
+
+import twiggy as _twiggy
+
+#: should metrics be counted
+enabled = False
+
+class Counters(object):
+    """A set of counters, accumulated per-thread.
+
+    Keys are strings, or ``(name, level)`` tuples for per-level counts.
+    Counts of threads which have exited are folded into a shared total.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._all = [] # (thread, counts)
+        self._base = self._empty() # counts of exited threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _empty():
+        """return a new, empty set of counts for a thread - for internal use"""
+        return {}
+
+    @staticmethod
+    def _merge(total, counts):
+        """add ``counts`` into ``total`` - for internal use"""
+        for k, v in counts.items():
+            total[k] = total.get(k, 0) + v
+
+    @staticmethod
+    def _reset(counts):
+        """reset ``counts`` to zero - for internal use"""
+        counts.clear()
+
+    def _prune(self):
+        """fold counts of exited threads into the shared total. Call with the lock held - for internal use"""
+        alive = []
+        for t, counts in self._all:
+            if t.is_alive():
+                alive.append((t, counts))
+            else:
+                # an exited thread can't be counting any more
+                self._merge(self._base, counts)
+        self._all = alive
+
+    def _new_counts(self):
+        """create & register the current thread's counts - for internal use"""
+        d = self._local.counts = self._empty()
+        with self._lock:
+            self._prune()
+            self._all.append((threading.current_thread(), d))
+        return d
+
+    def _thread_counts(self):
+        """return the current thread's counts - for internal use"""
+        try:
+            return self._local.counts
+        except AttributeError:
+            return self._new_counts()
+
+    def _totals(self):
+        """return counts summed across all threads - for internal use"""
+        total = self._empty()
+        with self._lock:
+            self._prune()
+            self._merge(total, self._base)
+            all_counts = [counts for t, counts in self._all]
+        for counts in all_counts:
+            self._merge(total, counts)
+        return total
+
+    def incr(self, key, n=1):
+        """add ``n`` to the counter ``key``"""
+        d = self._thread_counts()
+        d[key] = d.get(key, 0) + n
+
+    def snapshot(self):
+        """return a dictionary of totals across all threads"""
+        return self._totals()
+
+    def clear(self):
+        """reset all counters to zero"""
+        with self._lock:
+            self._base = self._empty()
+            for t, counts in self._all:
+                self._reset(counts)
+
+#: counters for all `Loggers <.Logger>`
+logger = Counters()
+
+def snapshot(emitters=None):
+    """return the current metrics as a dictionary, with keys:
+
+    :logger: counts from `.logger`
+    :emitters: a dictionary of emitter name to that emitter's counts. Each
+        also has an ``output`` key, containing metrics for its output.
+
+    :arg dict emitters: the emitters to report on. Defaults to :data:`twiggy.emitters`.
+    """
+    if emitters is None:
+        emitters = _twiggy.emitters
+
+    emitter_metrics = {}
+    for name, emitter in emitters.items():
+        d = emitter.metrics.snapshot()
+        d['output'] = emitter._output.get_metrics()
+        emitter_metrics[name] = d
+
+    return {'logger': logger.snapshot(), 'emitters': emitter_metrics}
+
+# these are gauges; everything else is a counter
+_gauges = frozenset(['queue_depth'])
+
+def _escape(s):
+    return str(s).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_counts(lines, prefix, counts, labels):
+    for key, value in sorted(counts.items()):
+        if isinstance(key, tuple):
+            key, level = key
+            key_labels = labels + [('level', level)]
+        else:
+            key_labels = labels
+
+        metric = prefix + key if key in _gauges else prefix + key + '_total'
+        if key_labels:
+            metric += '{' + ','.join('{0}="{1}"'.format(k, _escape(v)) for k, v in key_labels) + '}'
+        lines.append("{0} {1}".format(metric, value))
+
+def format_prometheus(snap):
+    """format a `.snapshot` in the Prometheus text exposition format"""
+    lines = []
+    _format_counts(lines, 'twiggy_logger_', snap['logger'], [])
+    for name, d in sorted(snap['emitters'].items()):
+        d = d.copy()
+        output = d.pop('output')
+        _format_counts(lines, 'twiggy_emitter_', d, [('emitter', name)])
+        _format_counts(lines, 'twiggy_output_', output, [('emitter', name)])
+    lines.append('')
+    return '\n'.join(lines)
+
+def dump(filename, emitters=None):
+    """write a `.snapshot` to ``filename`` in Prometheus text format.
+
+    The file is replaced atomically, so it's safe for a collector to read at any time.
+    """
+    text = format_prometheus(snapshot(emitters))
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.rename(tmp, filename)
+
+def dump_periodically(filename, interval=60, emitters=None):
+    """`.dump` every ``interval`` seconds from a daemon thread. Returns the thread."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                dump(filename, emitters)
+            except StandardError:
+                _twiggy.internal_log.warning("Error dumping metrics to {0}", filename)
+
+    t = threading.Thread(target=loop, name='twiggy.metrics')
+    t.daemon = True
+    t.start()
+    return t
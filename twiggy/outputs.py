@@ -1,13 +1,25 @@
-import multiprocessing
 import threading
 import sys
 import atexit
+import time
+import Queue
+import heapq
+import itertools
+from collections import OrderedDict, deque
+
+import levels
+import metrics
+import profiling
+import twiggy as _twiggy
 
 class Output(object):
     """Does the work of formatting and writing a message."""
 
     use_locks = True
 
+    # writing from another process, see `.AsyncOutput`
+    _is_async = False
+
     @staticmethod
     def _noop_format(msg):
         """a format that that just returns the message unchanged - for internal use"""
@@ -19,11 +31,21 @@ class Output(object):
         :arg bool close_atexit: should :meth:`.close` be registered with :mod:`atexit`. If False, the user is responsible for closing the output.
         """
         self._format = format if format is not None else self._noop_format
+        self._stats_init()
         self._sync_init()
 
         if close_atexit: #pragma: no cover
             atexit.register(self.close)
 
+    def _stats_init(self):
+        """set up metrics & profiling - for internal use"""
+        #: `.Counters` for this output, see `.metrics`
+        self.metrics = metrics.Counters()
+        #: `.Timings` for this output, see `.profiling`
+        self.timings = profiling.Timings()
+        #: dictionary of level to `.Histogram` of output latency, see `.profiling`
+        self.latency = profiling.level_histograms()
+
     def _sync_init(self):
         """the guts of init - for internal use"""
         if self.use_locks:
@@ -50,21 +72,81 @@ class Output(object):
         """
         raise NotImplementedError
 
+    def uses_field(self, key):
+        """does this output use the field ``key``.
+
+        If no output uses a field, callables for it aren't evaluated, and it's
+        left out of the message. Defaults to asking the format, if it has a
+        ``uses_field`` method, and True otherwise.
+        """
+        uses = getattr(self._format, 'uses_field', None)
+        return uses is None or uses(key)
+
+    def get_metrics(self):
+        """return a dictionary of metrics for this output. See `.metrics`."""
+        return self.metrics.snapshot()
+
+    def _count(self, x):
+        """update metrics for a written object - for internal use"""
+        self.metrics.incr('messages')
+        if isinstance(x, basestring):
+            self.metrics.incr('bytes_written', len(x))
+
     def __sync_output_locked(self, msg):
+        if profiling.enabled:
+            return self.__profiled_output(msg)
         x = self._format(msg)
         with self._lock:
             self._write(x)
+        if metrics.enabled: self._count(x)
 
     def __sync_output_unlocked(self, msg):
+        if profiling.enabled:
+            return self.__profiled_output(msg)
         x = self._format(msg)
         self._write(x)
+        if metrics.enabled: self._count(x)
+
+    def __profiled_output(self, msg):
+        start = profiling.timer()
+        x = self._format(msg)
+        formatted = profiling.timer()
+        self.timings.add('format', formatted - start)
+        if self.use_locks:
+            with self._lock:
+                self._write(x)
+        else:
+            self._write(x)
+        self.timings.add('write', profiling.timer() - formatted)
+        if metrics.enabled: self._count(x)
+
+
+def _msg_size(msg):
+    """estimated size of an unformatted message - for internal use"""
+    size = len(msg.text)
+    if msg.traceback is not None:
+        size += len(msg.traceback)
+    return size
 
 
 class AsyncOutput(Output):
     """An `.Output` with support for asynchronous logging"""
 
-    def __init__(self, format=None, msg_buffer=0, close_atexit=True):
+    #: valid values for ``overflow``
+    overflow_policies = ('raise', 'block', 'drop_newest', 'drop_oldest', 'sample')
+
+    def __init__(self, format=None, msg_buffer=0, close_atexit=True, overflow='raise',
+                 timeout=None, sample_rate=10, max_bytes=None):
+        if overflow not in self.overflow_policies:
+            raise ValueError("Unknown overflow policy: {0!r}".format(overflow))
         self._format = format if format is not None else self._noop_format
+        self.overflow = overflow
+        self.timeout = timeout
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        #: number of messages dropped because the buffer was full
+        self.dropped = 0
+        self._stats_init()
         if msg_buffer == 0:
             self._sync_init()
         else:
@@ -75,9 +157,18 @@ class AsyncOutput(Output):
 
     def _async_init(self, msg_buffer, close_atexit):
         """the guts of init - for internal use"""
+        # multiprocessing is slow to import; only pay for it if it's used
+        import multiprocessing
+        self._is_async = True
         self.output = self.__async_output
         self.close = self.__async_close
         self.__queue = multiprocessing.JoinableQueue(msg_buffer)
+        self.__closed = False
+        # shared with the child, which subtracts sizes of written messages
+        self.__bytes = multiprocessing.Value('l', 0) if self.max_bytes is not None else None
+        self.__overflow_lock = threading.Lock()
+        self.__sampling = False
+        self.__sample_count = 0
         self.__child = multiprocessing.Process(target=self.__child_main, args=(self,))
         self.__child.daemon = (msg_buffer > 0) # need to force this, otherwise the child processes created are left hanging
         self.__child.start()
@@ -90,6 +181,9 @@ class AsyncOutput(Output):
             # XXX should _close() be in a finally: ?
             msg = self.__queue.get()
             if msg != "SHUTDOWN":
+                if self.__bytes is not None:
+                    with self.__bytes.get_lock():
+                        self.__bytes.value -= _msg_size(msg)
                 x = self._format(msg)
                 self._write(x)
                 del x, msg
@@ -100,11 +194,103 @@ class AsyncOutput(Output):
                 self.__queue.task_done()
                 break
 
+    def __reserve(self, size):
+        """account for ``size`` bytes, if they fit in ``max_bytes`` - for internal use"""
+        with self.__bytes.get_lock():
+            if self.__bytes.value + size > self.max_bytes:
+                return False
+            self.__bytes.value += size
+            return True
+
+    def __put(self, msg):
+        """try to enqueue without blocking. Returns False if there was no room - for internal use"""
+        if self.__bytes is not None:
+            size = _msg_size(msg)
+            if not self.__reserve(size):
+                return False
+        try:
+            self.__queue.put_nowait(msg)
+        except Queue.Full:
+            if self.__bytes is not None:
+                with self.__bytes.get_lock():
+                    self.__bytes.value -= size
+            return False
+        return True
+
+    def __drop_oldest(self):
+        """discard the oldest queued message. Returns False if the queue was empty - for internal use"""
+        try:
+            # the queue's feeder thread may not have sent everything yet; give it a moment
+            old = self.__queue.get(True, 0.1)
+        except Queue.Empty:
+            return False
+        if self.__bytes is not None:
+            with self.__bytes.get_lock():
+                self.__bytes.value -= _msg_size(old)
+        self.__queue.task_done()
+        return True
+
+    def get_metrics(self):
+        d = super(AsyncOutput, self).get_metrics()
+        d['dropped'] = self.dropped
+        try:
+            d['queue_depth'] = self.__queue.qsize()
+        except (AttributeError, NotImplementedError):
+            # not running asynchronously, or qsize() is broken on this platform
+            pass
+        return d
+
     def __async_output(self, msg):
-        self.__queue.put_nowait(msg)
+        if (not self.__sampling and self.__put(msg)) or self.__overflow(msg):
+            if metrics.enabled: self.metrics.incr('messages')
+        else:
+            with self.__overflow_lock:
+                self.dropped += 1
+
+    def __overflow(self, msg):
+        """apply the overflow policy when the buffer is full. Returns True if
+        the message was eventually queued - for internal use"""
+        overflow = self.overflow
+        if overflow == 'raise':
+            raise Queue.Full
+        elif overflow == 'block':
+            if self.__bytes is None:
+                try:
+                    self.__queue.put(msg, True, self.timeout)
+                except Queue.Full:
+                    return False
+                return True
+            else:
+                # no way to wait on the byte count; poll
+                deadline = time.time() + self.timeout if self.timeout is not None else None
+                while deadline is None or time.time() < deadline:
+                    time.sleep(0.001)
+                    if self.__put(msg):
+                        return True
+        elif overflow == 'drop_oldest':
+            with self.__overflow_lock:
+                while not self.__put(msg):
+                    if not self.__drop_oldest():
+                        return False
+                    self.dropped += 1
+                return True
+        elif overflow == 'sample':
+            # while overloaded, only try 1 in sample_rate messages
+            with self.__overflow_lock:
+                self.__sampling = True
+                self.__sample_count += 1
+                if self.__sample_count >= self.sample_rate:
+                    self.__sample_count = 0
+                    if self.__put(msg):
+                        self.__sampling = False
+                        return True
+        return False
 
     def __async_close(self):
-        self.__queue.put_nowait("SHUTDOWN") # XXX maybe just put?
+        # may be closed by `.Emitters.replace` and again at exit
+        if self.__closed: return
+        self.__closed = True
+        self.__queue.put("SHUTDOWN")
         self.__queue.close()
         self.__queue.join()
 
@@ -114,6 +300,9 @@ class NullOutput(Output):
 
     use_locks = False
 
+    def uses_field(self, key):
+        return False
+
     def _open(self):
         pass
 
@@ -144,32 +333,423 @@ class ListOutput(Output):
         del self.messages[:]
 
 
+class RingBufferOutput(Output):
+    """A flight recorder: keeps the most recent messages in memory, unformatted,
+    and writes them to another output only when something goes wrong.
+
+    Messages at or above ``trigger_level`` cause the whole buffer (including the
+    triggering message) to be passed to ``output``. The buffer may also be
+    dumped on demand with `.flush`.
+
+    :arg Output output: the output to flush buffered messages to
+    :arg int capacity: maximum number of messages to keep
+    :arg int max_bytes: optional limit on the total size of buffered messages.
+        Messages aren't formatted, so size is estimated from their text and traceback.
+    :arg `.LogLevel` trigger_level: lowest level that causes the buffer to be flushed
+    :arg bool flush_on_close: should remaining messages be flushed on `.close`
+    """
+
+    def __init__(self, output, capacity=1000, max_bytes=None, trigger_level=levels.ERROR,
+                 flush_on_close=False, close_atexit=True):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive: {0!r}".format(capacity))
+        self.target = output
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.trigger_level = trigger_level
+        self.flush_on_close = flush_on_close
+        super(RingBufferOutput, self).__init__(None, close_atexit)
+
+    def uses_field(self, key):
+        return self.target.uses_field(key)
+
+    def _open(self):
+        # preallocated; _start is the oldest message, _count the number buffered
+        self._buffer = [None] * self.capacity
+        self._sizes = [0] * self.capacity
+        self._start = 0
+        self._count = 0
+        self._bytes = 0
+
+    def _drop_oldest(self):
+        self._bytes -= self._sizes[self._start]
+        self._buffer[self._start] = None
+        self._start = (self._start + 1) % self.capacity
+        self._count -= 1
+
+    def _write(self, msg):
+        if self._count == self.capacity:
+            self._drop_oldest()
+
+        if self.max_bytes is not None:
+            size = _msg_size(msg)
+            while self._count and self._bytes + size > self.max_bytes:
+                self._drop_oldest()
+        else:
+            size = 0
+
+        i = (self._start + self._count) % self.capacity
+        self._buffer[i] = msg
+        self._sizes[i] = size
+        self._bytes += size
+        self._count += 1
+
+        if msg.level >= self.trigger_level:
+            self._flush()
+
+    def _flush(self):
+        """does the work of flushing - for internal use. Caller holds the lock."""
+        buf, start, count, capacity = self._buffer, self._start, self._count, self.capacity
+        msgs = [buf[(start + i) % capacity] for i in xrange(count)]
+        for i in xrange(capacity):
+            buf[i] = None
+        self._start = self._count = self._bytes = 0
+
+        for msg in msgs:
+            self.target.output(msg)
+
+    def flush(self):
+        """write all buffered messages to the target output and empty the buffer"""
+        if self.use_locks:
+            with self._lock:
+                self._flush()
+        else:
+            self._flush()
+
+    def _close(self):
+        if self.flush_on_close:
+            self._flush()
+        else:
+            # just discard everything
+            self._open()
+
+
+class FingersCrossedOutput(Output):
+    """Buffer messages per group (request, job, etc.), writing a group to another
+    output only if it contains an error.
+
+    Messages are grouped by the value of the field ``key``. Messages without
+    that field are written through immediately. When a message at or above
+    ``trigger_level`` arrives, the group's buffered messages are written, and
+    the rest of the group is passed through unbuffered. Call `.finish` when a
+    group completes to discard its messages.
+
+    Groups that haven't seen a message in ``timeout`` seconds, and the least
+    recently used groups beyond ``max_groups``, are discarded.
+
+    :arg Output output: the output to write triggered groups to
+    :arg string key: the field to group messages by
+    :arg `.LogLevel` trigger_level: lowest level that causes a group to be written
+    :arg int max_messages: maximum number of messages to buffer per group; the oldest are dropped
+    :arg int max_groups: maximum number of groups to track
+    :arg float timeout: seconds of inactivity after which a group is discarded. None means never.
+    """
+
+    def __init__(self, output, key='request_id', trigger_level=levels.ERROR, max_messages=100,
+                 max_groups=1000, timeout=300, close_atexit=True):
+        self.target = output
+        self.key = key
+        self.trigger_level = trigger_level
+        self.max_messages = max_messages
+        self.max_groups = max_groups
+        self.timeout = timeout
+        super(FingersCrossedOutput, self).__init__(None, close_atexit)
+
+    def uses_field(self, key):
+        return key == self.key or self.target.uses_field(key)
+
+    def _open(self):
+        # group -> [last_seen, deque of messages or None if triggered]
+        # ordered by last use, oldest first
+        self._groups = OrderedDict()
+
+    def _evict(self, now):
+        """discard stale & excess groups - for internal use"""
+        groups = self._groups
+        if self.timeout is not None:
+            cutoff = now - self.timeout
+            while groups:
+                group, (last_seen, _) = next(groups.iteritems())
+                if last_seen >= cutoff:
+                    break
+                del groups[group]
+
+        while len(groups) > self.max_groups:
+            groups.popitem(last=False)
+
+    def _write(self, msg):
+        try:
+            group = msg.fields[self.key]
+        except KeyError:
+            self.target.output(msg)
+            return
+
+        now = time.time()
+        state = self._groups.pop(group, None)
+        if state is None:
+            state = [now, deque(maxlen=self.max_messages)]
+        state[0] = now
+        self._groups[group] = state
+        self._evict(now)
+
+        buffered = state[1]
+        if buffered is None:
+            # already triggered
+            self.target.output(msg)
+        elif msg.level >= self.trigger_level:
+            state[1] = None
+            for m in buffered:
+                self.target.output(m)
+            self.target.output(msg)
+        else:
+            buffered.append(msg)
+
+    def finish(self, group):
+        """the group completed; discard any buffered messages
+
+        :arg group: the value of the ``key`` field for the group
+        """
+        if self.use_locks:
+            with self._lock:
+                self._groups.pop(group, None)
+        else:
+            self._groups.pop(group, None)
+
+    def _close(self):
+        self._groups.clear()
+
+
+class ThreadedOutput(Output):
+    """Write to another output from a background thread.
+
+    Calling `.output` only puts the message on a queue, so callers (request
+    handlers, event loops, etc.) never block on I/O or on the wrapped output's
+    lock. Formatting is done in the background thread as well.
+
+    :arg Output output: the output to write to
+    :arg int msg_buffer: number of messages to queue. ``0`` or negative means unlimited.
+        If the queue is full, :exc:`Queue.Full` is raised.
+    """
+
+    use_locks = False # Queue does its own locking
+
+    _SHUTDOWN = object()
+
+    def __init__(self, output, msg_buffer=0, close_atexit=True):
+        self.target = output
+        self.msg_buffer = msg_buffer
+        super(ThreadedOutput, self).__init__(None, close_atexit)
+
+    def uses_field(self, key):
+        return self.target.uses_field(key)
+
+    def _open(self):
+        self._queue = Queue.Queue(max(self.msg_buffer, 0))
+        self._thread = threading.Thread(target=self._worker, name='twiggy.ThreadedOutput')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _worker(self):
+        """main loop of the background thread - for internal use"""
+        queue = self._queue
+        while True:
+            msg = queue.get()
+            try:
+                if msg is self._SHUTDOWN:
+                    break
+                try:
+                    self.target.output(msg)
+                except StandardError:
+                    _twiggy.internal_log.warning("Error outputting with {0!r}. Message: {1!r}", self.target, msg)
+            finally:
+                queue.task_done()
+
+    def _write(self, msg):
+        self._queue.put_nowait(msg)
+
+    def get_metrics(self):
+        d = super(ThreadedOutput, self).get_metrics()
+        d['queue_depth'] = self._queue.qsize()
+        return d
+
+    def flush(self):
+        """block until all queued messages have been written"""
+        self._queue.join()
+
+    def _close(self):
+        self._queue.put(self._SHUTDOWN)
+        self._thread.join()
+
+
+class ThreadBufferedOutput(Output):
+    """Buffer formatted messages per-thread, and write them to another output in batches.
+
+    Many threads writing to one output contend for its lock on every message.
+    Here, each thread formats and appends to its own buffer without locking;
+    buffers are merged and written when any thread's buffer reaches
+    ``buffer_size`` messages, every ``flush_interval`` seconds, and on `.flush`
+    or `.close`. Messages from each thread are written in order; messages from
+    different threads are ordered by when they were output.
+
+    If writing fails, the unwritten messages stay buffered for the next flush.
+
+    :arg Output output: the output whose format & `._write` to use. Can't be using :term:`asynchronous logging`.
+    :arg int buffer_size: number of messages a thread may buffer before flushing
+    :arg float flush_interval: seconds between background flushes. None means no background flushing.
+    """
+
+    use_locks = False # thread-local buffers
+
+    def __init__(self, output, buffer_size=100, flush_interval=1.0, close_atexit=True):
+        if output._is_async:
+            raise ValueError("Can't buffer for an asynchronous output: {0!r}".format(output))
+        self.target = output
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        super(ThreadBufferedOutput, self).__init__(None, close_atexit)
+
+    def uses_field(self, key):
+        return self.target.uses_field(key)
+
+    def _open(self):
+        self._local = threading.local()
+        self._buffers = [] # (thread, deque of (sequence, formatted, level))
+        self._buffers_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._closing = threading.Event()
+        if self.flush_interval is not None:
+            self._flusher = threading.Thread(target=self._flusher_main, name='twiggy.ThreadBufferedOutput')
+            self._flusher.daemon = True
+            self._flusher.start()
+        else:
+            self._flusher = None
+
+    def _flusher_main(self):
+        """background flushing loop - for internal use"""
+        while not self._closing.wait(self.flush_interval):
+            try:
+                self.flush()
+            except StandardError:
+                _twiggy.internal_log.warning("Error flushing {0!r}", self)
+
+    def _new_buffer(self):
+        """create & register the current thread's buffer - for internal use"""
+        buf = self._local.buffer = deque()
+        with self._buffers_lock:
+            self._buffers.append((threading.current_thread(), buf))
+        return buf
+
+    def _write(self, msg):
+        try:
+            buf = self._local.buffer
+        except AttributeError:
+            buf = self._new_buffer()
+        target = self.target
+        if profiling.enabled:
+            start = profiling.timer()
+            x = target._format(msg)
+            target.timings.add('format', profiling.timer() - start)
+        else:
+            x = target._format(msg)
+        # deque.append and count.next are atomic, so no locking needed
+        buf.append((next(self._sequence), x, msg.level))
+        if len(buf) >= self.buffer_size:
+            self.flush(block=False)
+
+    def flush(self, block=True):
+        """merge all threads' buffers and write them.
+
+        :arg bool block: if False, and another thread is already flushing, return immediately
+        """
+        if not self._flush_lock.acquire(block):
+            return
+        try:
+            with self._buffers_lock:
+                buffers = list(self._buffers)
+                # forget about threads that are gone, once we're done with their buffers
+                self._buffers = [(t, buf) for t, buf in buffers if buf or t.is_alive()]
+
+            batches = []
+            for t, buf in buffers:
+                # only take what's there now; the owning thread may still be appending.
+                # entries are removed once written, so nothing is lost if writing fails.
+                batches.append([buf[i] + (buf,) for i in xrange(len(buf))])
+
+            target = self.target
+            count = metrics.enabled
+            profile = profiling.enabled
+            timed = profiling.latency_enabled
+            lock = target._lock if target.use_locks else None
+            if lock is not None: lock.acquire()
+            try:
+                for seq, x, level, buf in heapq.merge(*batches):
+                    if profile or timed: start = profiling.timer()
+                    target._write(x)
+                    # only flush removes entries, so this one is at the front
+                    buf.popleft()
+                    if profile or timed: elapsed = profiling.timer() - start
+                    if profile: target.timings.add('write', elapsed)
+                    if timed: target.latency[level].record(elapsed)
+                    if count: target._count(x)
+            finally:
+                if lock is not None: lock.release()
+        finally:
+            self._flush_lock.release()
+
+    def _close(self):
+        self._closing.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+
 class FileOutput(AsyncOutput):
     """Output messages to a file
 
-    ``name``, ``mode``, ``buffering`` are passed to :func:`open`
+    ``name``, ``mode``, ``buffering`` are passed to :func:`open`. Remaining
+    keyword arguments are passed to `.AsyncOutput`.
+
+    If ``delay`` is True, the file isn't opened (or created) until the first
+    message is written.
     """
-    def __init__(self, name, format, mode='a', buffering=1, msg_buffer=0, close_atexit=True):
+    def __init__(self, name, format, mode='a', buffering=1, msg_buffer=0, close_atexit=True,
+                 delay=True, **kwargs):
         self.filename = name
         self.mode = mode
         self.buffering = buffering
-        super(FileOutput, self).__init__(format, msg_buffer, close_atexit)
+        self.delay = delay
+        super(FileOutput, self).__init__(format, msg_buffer, close_atexit, **kwargs)
 
     def _open(self):
-        self.file = open(self.filename, self.mode, self.buffering)
+        self.file = None
+        self._open_lock = threading.Lock()
+        if not self.delay:
+            self._open_file()
+
+    def _open_file(self):
+        """actually open the file - for internal use"""
+        with self._open_lock:
+            if self.file is None:
+                self.file = open(self.filename, self.mode, self.buffering)
+        return self.file
 
     def _close(self):
-        self.file.close()
+        if self.file is not None:
+            self.file.close()
 
     def _write(self, x):
-        self.file.write(x)
+        (self.file or self._open_file()).write(x)
 
 
 class StreamOutput(AsyncOutput):
-    """Output to an externally-managed stream."""
-    def __init__(self, format, stream=sys.stderr, msg_buffer=0):
+    """Output to an externally-managed stream.
+
+    Remaining keyword arguments are passed to `.AsyncOutput`.
+    """
+    def __init__(self, format, stream=sys.stderr, msg_buffer=0, **kwargs):
         self.stream = stream
-        super(StreamOutput, self).__init__(format, msg_buffer, close_atexit=(msg_buffer>0))
+        super(StreamOutput, self).__init__(format, msg_buffer, close_atexit=(msg_buffer>0), **kwargs)
 
     def _open(self):
         pass
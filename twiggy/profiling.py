@@ -0,0 +1,225 @@
+"""Per-stage timing of the emit pipeline.
+
+Profiling is off by default. Set ``enabled`` to True to start timing::
+
+    twiggy.profiling.enabled = True
+
+The following stages are timed:
+
+:logger: ``logger_filter`` (`.Logger.filter`), ``message`` (`.Message`
+    creation) and ``callables`` (evaluating callable fields & arguments, part of ``message``)
+:emitters: ``pre_filter`` (`.Emitter.pre_filter`) and ``filter`` (`.Emitter.filter`)
+:outputs: ``format`` and ``write``. Outputs using :term:`asynchronous logging`
+    do this work in another process, and aren't timed.
+
+Timings are accumulated per-thread and only summed when a `.snapshot` is taken.
+When profiling is off, the only cost is checking ``enabled``.
+"""
+
+__all__ = ['enabled', 'Timings', 'logger', 'snapshot', 'report',
+           'Histogram', 'calls', 'record_latency', 'latency_snapshot']
+
+import sys
+import time
+
+from .metrics import Counters
+from . import levels
+import twiggy as _twiggy
+
+#: should the pipeline be timed
+enabled = False
+
+# same as timeit.default_timer, without importing timeit
+timer = time.clock if sys.platform == 'win32' else time.time
+
+class Timings(Counters):
+    """Accumulated ``(count, total seconds)`` per stage, accumulated per-thread."""
+
+    def add(self, stage, seconds):
+        """record one run of ``stage`` taking ``seconds``"""
+        d = self._thread_counts()
+        t = d.get(stage)
+        if t is None:
+            d[stage] = [1, seconds]
+        else:
+            t[0] += 1
+            t[1] += seconds
+
+    @staticmethod
+    def _merge(total, counts):
+        for stage, (count, seconds) in counts.items():
+            t = total.get(stage)
+            if t is None:
+                total[stage] = [count, seconds]
+            else:
+                t[0] += count
+                t[1] += seconds
+
+    def snapshot(self):
+        """return a dictionary of stage to ``(count, total seconds)`` across all threads"""
+        return dict((stage, tuple(t)) for stage, t in self._totals().items())
+
+#: `.Timings` shared by all `Loggers <.Logger>`
+logger = Timings()
+
+def snapshot(emitters=None):
+    """return the current timings as a dictionary, with keys:
+
+    :logger: timings from `.logger`
+    :emitters: a dictionary of emitter name to that emitter's timings. Each
+        also has an ``output`` key, containing timings for its output.
+
+    :arg dict emitters: the emitters to report on. Defaults to :data:`twiggy.emitters`.
+    """
+    if emitters is None:
+        emitters = _twiggy.emitters
+
+    emitter_timings = {}
+    for name, emitter in emitters.items():
+        d = emitter.timings.snapshot()
+        d['output'] = emitter._output.timings.snapshot()
+        emitter_timings[name] = d
+
+    return {'logger': logger.snapshot(), 'emitters': emitter_timings}
+
+def _report_timings(log, timings):
+    for stage, (count, seconds) in sorted(timings.items()):
+        log.fields(stage=stage, count=count, total=seconds,
+                   mean=seconds / count).info("twiggy profile")
+
+def report(emitters=None):
+    """log a `.snapshot` to :data:`.devel_log`, one message per stage"""
+    snap = snapshot(emitters)
+    _report_timings(_twiggy.devel_log.fields(part='logger'), snap['logger'])
+    for name, d in sorted(snap['emitters'].items()):
+        d = d.copy()
+        output = d.pop('output')
+        _report_timings(_twiggy.devel_log.fields(part='emitter', emitter=name), d)
+        _report_timings(_twiggy.devel_log.fields(part='output', emitter=name), output)
+
+
+## Latency histograms
+
+#: are `.record_latency` histograms being recorded
+latency_enabled = False
+
+# values below 2 ** _SUB_BITS nanoseconds get a bucket each. Above that, each
+# power of two is split into 2 ** (_SUB_BITS - 1) linear buckets (~12% error)
+_SUB_BITS = 4
+_HALF = 1 << (_SUB_BITS - 1)
+_NBUCKETS = 320 # enough for over an hour
+
+def _bucket(ns):
+    """return the bucket index for a latency in nanoseconds - for internal use"""
+    if ns < (1 << _SUB_BITS):
+        return ns
+    shift = ns.bit_length() - _SUB_BITS
+    i = shift * _HALF + (ns >> shift)
+    return i if i < _NBUCKETS else _NBUCKETS - 1
+
+def _bucket_high(i):
+    """return the highest latency in nanoseconds in bucket ``i`` - for internal use"""
+    if i < (1 << _SUB_BITS):
+        return i
+    shift, mantissa = divmod(i, _HALF)
+    shift -= 1
+    return ((mantissa + _HALF + 1) << shift) - 1
+
+class Histogram(Counters):
+    """A log-linear histogram of latencies, accumulated per-thread.
+
+    Buckets are fixed and allocated once per thread, so recording doesn't allocate.
+    """
+
+    @staticmethod
+    def _empty():
+        # the last slot holds the maximum
+        return [0] * (_NBUCKETS + 1)
+
+    def record(self, seconds):
+        """record one latency"""
+        # the timer is a wall clock, which may step backwards
+        ns = max(0, int(seconds * 1e9))
+        counts = self._thread_counts()
+        counts[_bucket(ns)] += 1
+        if ns > counts[_NBUCKETS]:
+            counts[_NBUCKETS] = ns
+
+    @staticmethod
+    def _merge(total, counts):
+        for i, c in enumerate(counts[:_NBUCKETS]):
+            total[i] += c
+        total[_NBUCKETS] = max(total[_NBUCKETS], counts[_NBUCKETS])
+
+    @staticmethod
+    def _reset(counts):
+        counts[:] = Histogram._empty()
+
+    def snapshot(self):
+        """return a dictionary with keys ``count``, ``p50``, ``p99``, ``p999`` and ``max``.
+
+        Latencies are in seconds; percentiles are the upper bound of their bucket.
+        """
+        total = self._totals()
+        n = sum(total[:_NBUCKETS])
+        max_ns = total[_NBUCKETS]
+        d = {'count': n, 'max': max_ns / 1e9}
+        for name, q in (('p50', 0.5), ('p99', 0.99), ('p999', 0.999)):
+            d[name] = self._percentile(total, n, q, max_ns) / 1e9
+        return d
+
+    @staticmethod
+    def _percentile(total, n, q, max_ns):
+        if not n:
+            return 0
+        rank = q * n
+        seen = 0
+        for i in xrange(_NBUCKETS):
+            seen += total[i]
+            if seen >= rank:
+                return min(_bucket_high(i), max_ns)
+        return max_ns # pragma: no cover
+
+def level_histograms():
+    """return a dictionary of each `.LogLevel` to a new `.Histogram`"""
+    return dict((level, Histogram()) for level in levels.LogLevel._name2levels.values())
+
+#: dictionary of level to `.Histogram` of the time taken by ``log.<level>()`` calls
+calls = level_histograms()
+
+def record_latency(enabled=True):
+    """turn recording of latency histograms on or off.
+
+    When on, the time taken by each ``log.<level>()`` call is recorded in `.calls`,
+    and the time taken by each output in its ``latency`` attribute.
+    """
+    global latency_enabled
+    from .logger import Logger
+    latency_enabled = enabled
+    name = '_timed_emit' if enabled else '_untimed_emit'
+    # get func directly from class dict - we don't want an unbound method.
+    Logger._emit = Logger.__dict__[name]
+
+def _histogram_snapshots(histograms):
+    return dict((str(level), h.snapshot()) for level, h in histograms.items())
+
+def latency_snapshot(emitters=None):
+    """return latency histograms as a dictionary, with keys:
+
+    :calls: a dictionary of level name to `.Histogram.snapshot` of ``log.<level>()`` calls
+    :emitters: a dictionary of emitter name to a dictionary with an ``output`` key,
+        containing snapshots of that output's latency per level.
+
+    Levels without any samples are omitted.
+
+    :arg dict emitters: the emitters to report on. Defaults to :data:`twiggy.emitters`.
+    """
+    if emitters is None:
+        emitters = _twiggy.emitters
+
+    def nonempty(histograms):
+        return dict((k, v) for k, v in _histogram_snapshots(histograms).items() if v['count'])
+
+    return {'calls': nonempty(calls),
+            'emitters': dict((name, {'output': nonempty(emitter._output.latency)})
+                             for name, emitter in emitters.items())}